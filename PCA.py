@@ -49,7 +49,9 @@ def get_information():
 
 
 # Looking at and pre-processing the data.
-def look_at_and_pre_process_data(data, rawdata, variables):
+# Returned is the transform that describes the preprocessing, see 
+# data_preprocessing.get_transform().
+def look_at_and_pre_process_data(data, variables):
 	# Now plot the input data.
 	show_data = raw_input("Show the raw-data? (1 = YES): ")
 	if show_data == '1':
@@ -59,12 +61,16 @@ def look_at_and_pre_process_data(data, rawdata, variables):
 	text_1 = "Pre-process the data (ENTER = normalization AND mean centering, "
 	text_2 = "1 = JUST mean centering, 0 = None): "
 	these_processes = raw_input(text_1 + text_2)
-	data, rawdata = dp.preprocess_data(these_processes, data, rawdata)
 
 	# "Enhance" certain variables to put all their influence into one component.
 	text = "Enhance variables? As integers: Variable_1, Variable_2, ... ; ENTER = none): "
 	enhance_these = raw_input(text)
-	data, rawdata = dp.boost_variables(enhance_these, data, rawdata)
+
+	# Everything is done to data at once.
+	transform = dp.get_transform(these_processes, enhance_these, data)
+	dp.apply_transform(transform, data)
+
+	return transform
 
 
 
@@ -88,10 +94,12 @@ def main():
 	infile, number_of_components, graphtitle = get_information()
 
 	# Here the data is finally read from the file.
-	data, rawdata, variables, observations = rd.read_data(infile)
+	# The parsed data is cached, hence the next run with the same file will 
+	# start much faster.
+	data, variables, observations = rd.read_data(infile, cache = True)
 
 	# Look at and pre-process the data.
-	look_at_and_pre_process_data(data, rawdata, variables)
+	transform = look_at_and_pre_process_data(data, variables)
 
 	# Get the colour-coding (if applicable).
 	colours = get_colours(observations)
@@ -99,7 +107,8 @@ def main():
 	# Here the actual NIPALS algorithm is executed.
 	print "\nBe patient. The NIPALS-algorithm may need some time ...\n"
 	Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2 = na.nipals_pca(data, \
-														rawdata, number_of_components)
+					None, number_of_components, \
+					reference_variances = dp.reference_variances(transform))
 
 	# Plotting basic information.
 	pl.plotting_the_basics(number_of_components, R_2, graphtitle, observations, \
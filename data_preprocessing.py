@@ -23,39 +23,170 @@
 
 import numpy as np
 
-# these_processes can be "no input" (actually it is '') if the user 
-# presses just enter. In this case everything will be done.
-# If it is '1' just mean centering will take place.
-# If it is '0' nothing will be done.
-def preprocess_data(these_processes, data, rawdata):
+# The preprocessing is described by a "transform": for each column the mean 
+# that is subtracted, the scale (standard deviation) the data is divided by 
+# and the factor it is boosted with (see boost_variables()). 
+# So the data itself needs to be changed just once (apply_transform()) and 
+# no copy of the unchanged data is needed. 
+# The summed squares of each column around the mean are stored, too. From 
+# these the variances of the preprocessed data follow without looking at the
+# data again (see reference_variances()).
+# 
+# data is looked at just once, block_size rows at a time (see 
+# column_moments()). Thus this works on memory mapped data, too.
+# data can be np.float32 (see read_data.read_data()). The moments are 
+# nevertheless calculated as np.float64.
+def get_transform(these_processes, enhance_these, data, block_size = None):
+	moments = column_moments(row_blocks(data, block_size))
+
+	return transform_from_moments(these_processes, enhance_these, moments)
+
+
+
+# The same as get_transform() but from the moments of the data (see 
+# column_moments()). E.g. if the data is never in memory at once:
+# 
+# variables, blocks = rd.stream_data(infile)
+# moments = column_moments(block for labels, block in blocks)
+# transform = transform_from_moments(these_processes, enhance_these, moments)
+def transform_from_moments(these_processes, enhance_these, moments):
+	so_many_observed, column_mean, centered_sums = moments
+	number_of_columns = len(so_many_observed)
+
+	mean = np.zeros(number_of_columns)
+	scale = np.ones(number_of_columns)
+	boost = np.ones(number_of_columns)
+
 	if these_processes == '' or these_processes == '1':
-		# data.mean(axis=0) gives the mean along one variable.
-		# np.nanmean(data, axis=0) does the same, just ignoring NaN's.
-		# A line vector is returned. So data.mean(axis=0).shape is (5,) => the second 
-		# indice is missing.
-		# Thus I have to transfer the line-vector into an array to be able to plot it.
-		mean_data = np.array([np.nanmean(data, axis=0)])
-
-		# Center the raw data.
-		# 
-		# This confuses me.
-		# data is an e.g. 50 x 5 array, while mean_data is a 1 x 5 array.
-		# it seems to be as if numpy interprets it in a way that from each
-		# row in data mean_data is substracted.
-		data -= mean_data
-		rawdata -= mean_data
+		mean = column_mean.copy()
+	else:
+		# Not centered, so the squares are summed around 0.
+		centered_sums = centered_sums + so_many_observed * column_mean**2
 
 	if these_processes == '':
-		# Scale the centered data.
-		# Same issue as above
+		# This is np.nanstd(data, axis = 0, ddof = 1).
 		# ddof: "Delta Degrees of Freedom". By default, this is 0. Set it to 1 
 		# to get the LibreOffice result.
 		# More context here: http://stackoverflow.com/questions/27600207/ ...
 		# ... why-does-numpy-std-give-a-different-result-to-matlab-std
-		standard_deviation = np.array([np.nanstd(data, axis = 0, ddof = 1)])
+		scale = np.sqrt(centered_sums / (so_many_observed - 1))
+
+	if enhance_these != '':
+		for variable in enhance_these.split(','):
+			boost[int(variable) - 1] *= 1000
+
+	return {'mean': mean, 'scale': scale, 'boost': boost, \
+			'centered_sums': centered_sums}
+
+
+
+# Goes through blocks (arrays with the same columns, e.g. row blocks of 
+# the data) just once and returns for each column how many values are not 
+# NaN, their mean and the summed squares around that mean.
+# The moments of each block are merged with the ones so far (see 
+# merge_moments()). That's Welford's way to do this and it does not lose 
+# precision like summing up x and x**2 would.
+def column_moments(blocks):
+	moments = None
+	for block in blocks:
+		if moments is None:
+			moments = block_moments(block)
+		else:
+			moments = merge_moments(moments, block_moments(block))
+
+	return moments
+
+
+
+# The moments of one block, see column_moments(). NaN's are ignored.
+# Everything is summed up as np.float64, whatever block is.
+def block_moments(block):
+	observed = ~np.isnan(block)
+	so_many_observed = observed.sum(axis=0).astype(np.float64)
+	filled_block = np.where(observed, block, 0).astype(np.float64)
+
+	mean = filled_block.sum(axis=0) / np.maximum(so_many_observed, 1)
+	filled_block -= mean
+	filled_block *= observed
+	centered_sums = np.einsum('ij,ij->j', filled_block, filled_block)
+
+	return so_many_observed, mean, centered_sums
+
+
+
+# Merges the moments of two parts of the data (Chan et al.). It doesn't 
+# matter how the data is split or in which order the parts are merged. 
+# Thus, e.g. each worker can do its part and the results are merged in the 
+# end.
+def merge_moments(moments_a, moments_b):
+	count_a, mean_a, sums_a = moments_a
+	count_b, mean_b, sums_b = moments_b
+
+	count = count_a + count_b
+	# Columns without any values stay 0.
+	weight_b = count_b / np.maximum(count, 1)
+	delta = mean_b - mean_a
+
+	mean = mean_a + delta * weight_b
+	centered_sums = sums_a + sums_b + delta**2 * count_a * weight_b
+
+	return count, mean, centered_sums
+
+
+
+# Yields block_size rows of data at a time. Without block_size so many rows
+# that one block has about 2**20 values.
+def row_blocks(data, block_size = None):
+	if block_size is None:
+		block_size = max(1, 2**20 // max(1, data.shape[1]))
+
+	for start in range(0, data.shape[0], block_size):
+		yield data[start:start + block_size]
+
+
+
+# Preprocesses data (in place) as described by transform.
+# This is done block by block and works for memory mapped data and for the 
+# blocks from read_data.stream_data() as well.
+# data keeps its dtype. For np.float32 each value is rounded once in the end.
+def apply_transform(transform, data, block_size = None):
+	factor = transform['boost'] / transform['scale']
+	for block in row_blocks(data, block_size):
+		if block.dtype == np.float64:
+			block -= transform['mean']
+			block *= factor
+		else:
+			block[...] = (block - transform['mean']) * factor
+
+	return data
+
+
+
+# The summed squares of the preprocessed data, all together and per column. 
+# This is what nipals_algorithm.raw_data_variances() would calculate from 
+# the preprocessed data.
+def reference_variances(transform):
+	column_variances = transform['centered_sums'] * \
+							(transform['boost'] / transform['scale'])**2
+
+	return np.sum(column_variances), column_variances
+
+
+
+# these_processes can be "no input" (actually it is '') if the user 
+# presses just enter. In this case everything will be done.
+# If it is '1' just mean centering will take place.
+# If it is '0' nothing will be done.
+# 
+# ATTENTION: rawdata is just still here for older code. Nothing in this 
+# program needs it any longer. Everything that is done to data is also done
+# to rawdata, if it is given.
+def preprocess_data(these_processes, data, rawdata = None):
+	transform = get_transform(these_processes, '', data)
 
-		data /= standard_deviation
-		rawdata /= standard_deviation
+	apply_transform(transform, data)
+	if rawdata is not None:
+		apply_transform(transform, rawdata)
 
 	return data, rawdata
 
@@ -64,7 +195,7 @@ def preprocess_data(these_processes, data, rawdata):
 # If the influence of one variable is known, one can put the influence of
 # this variable into one component by multiplying this column with 1000.
 # Then the other components "don't" contain this variable any longer.
-def boost_variables(enhance_these, data, rawdata):
+def boost_variables(enhance_these, data, rawdata = None):
 	if enhance_these != '':
 		enhance_these_variables = enhance_these.split(',')
 
@@ -72,7 +203,8 @@ def boost_variables(enhance_these, data, rawdata):
 		for variable in enhance_these_variables:
 			number = int(variable) - 1
 			data[:,number] *= 1000
-			rawdata[:,number] *= 1000
+			if rawdata is not None:
+				rawdata[:,number] *= 1000
 
 	return data, rawdata
 
@@ -0,0 +1,462 @@
+#    "PCA" (v0.7)
+#    Copyright 2016 Soren Heinze
+#    soerenheinze@gmx.de
+#    5B1C 1897 560A EF50 F1EB 2579 2297 FAE4 D9B5 2A35
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# NIPALS for data that is spread over several computers, each of which has
+# some of the rows (a "shard"). The data itself never leaves its computer.
+#
+# Each worker keeps its rows and the part of the score vector that belongs
+# to them. The coordinator (distributed_nipals_pca()) sends the loading to
+# all workers; each calculates the new scores of its rows and its part of
+# the sums for the next loading (X^T*Z and M^T*Z^2, one value per variable).
+# The coordinator adds these up, and so on. Just vectors with one value per
+# variable are sent during the iteration. The scores are collected just once
+# for each component.
+#
+# On each computer (the shard is what this computer has of the data, with
+# NaN's for missing values, e.g. from read_data.read_data()):
+#
+# run_worker(shard, ('', 6000), 'secret')
+#
+# and on the coordinator:
+#
+# connections = connect_workers([('node1', 6000), ('node2', 6000)], 'secret')
+# Z_merged, P_merged, ... = distributed_nipals_pca(connections, 3)
+# stop_workers(connections)
+#
+# To try it on one computer, start_local_workers() splits data into shards
+# and starts one process for each. The results are the same as from
+# nipals_algorithm.nipals_pca() (with rawdata = None).
+
+import numpy as np
+import traceback
+from math import sqrt
+from scipy import linalg as SLA
+from multiprocessing import Process, Pipe
+from multiprocessing.connection import Listener, Client
+import nipals_algorithm as na
+
+# Waits at address (host, port) for the coordinator and then does what it
+# is asked to do with shard, until the coordinator says 'close'.
+# authkey is a password (a string) both need to know.
+def run_worker(shard, address, authkey):
+	listener = Listener(address, authkey = authkey)
+	try:
+		connection = listener.accept()
+		serve_shard(connection, shard)
+	finally:
+		listener.close()
+
+
+
+# The connections to the workers of run_worker().
+def connect_workers(addresses, authkey):
+	return [Client(address, authkey = authkey) for address in addresses]
+
+
+
+# Splits the rows of data into workers shards and starts a process for each,
+# connected with a pipe. Returned are the connections (as from
+# connect_workers()) and the processes.
+def start_local_workers(data, workers = 2):
+	borders = np.linspace(0, data.shape[0], workers + 1).astype(int)
+
+	connections = []
+	processes = []
+	for i in range(workers):
+		here, there = Pipe()
+		process = Process(target = serve_shard, \
+						args = (there, data[borders[i]:borders[i + 1]]))
+		process.daemon = True
+		process.start()
+		there.close()
+
+		connections.append(here)
+		processes.append(process)
+
+	return connections, processes
+
+
+
+# The workers are not needed any longer.
+def stop_workers(connections):
+	for connection in connections:
+		connection.send(('close',))
+		connection.close()
+
+
+
+# What a worker does: it gets a message (a tuple, the first element is what
+# to do, see COMMANDS), does it and sends back the result.
+# The missing values are set to zero and a mask (1.0/0.0) says where the
+# data was observed, as for the vectorized engine of nipals_algorithm.
+def serve_shard(connection, shard):
+	observed = ~np.isnan(shard)
+	state = {'X': np.where(observed, shard, 0.0), \
+			'M': observed.astype(np.float64), 'Z': None, 'history': [], \
+			'all_Z': None}
+
+	while True:
+		message = connection.recv()
+		if message[0] == 'close':
+			connection.close()
+			return
+
+		try:
+			connection.send(('ok', COMMANDS[message[0]](state, *message[1:])))
+		except Exception:
+			connection.send(('error', traceback.format_exc()))
+
+
+
+# Sends message to all workers and returns all their answers. The workers
+# work at the same time, since each gets its message before the first
+# answer is waited for.
+def ask_all(connections, message):
+	for connection in connections:
+		connection.send(message)
+
+	answers = []
+	for connection in connections:
+		status, answer = connection.recv()
+		if status == 'error':
+			raise RuntimeError("A worker failed:\n" + answer)
+		answers.append(answer)
+
+	return answers
+
+
+
+# The answers of ask_all() added up, if each is a tuple of sums.
+def ask_sums(connections, message):
+	answers = ask_all(connections, message)
+
+	return [sum(parts) for parts in zip(*answers)]
+
+
+
+# Does what nipals_algorithm.nipals_pca() does, with the data of the
+# workers (see the top of this file). Everything that is not given here
+# works the same way as there. The residual stays with the workers and is
+# not in the info of full_output.
+def distributed_nipals_pca(connections, number_of_components, \
+					exact_if_complete = True, tolerance = None, relative = True, \
+					acceleration = None, reference_variances = None, \
+					full_output = False):
+	answers = ask_all(connections, ('sums',))
+	row_sums = np.concatenate([answer[0] for answer in answers])
+	column_sums = sum(answer[1] for answer in answers)
+	missing_data = any(answer[2] for answer in answers)
+	number_of_rows = len(row_sums)
+	number_of_columns = len(column_sums)
+
+	if reference_variances is not None:
+		variance_rawdata, column_variance_rawdata = reference_variances
+	else:
+		variance_rawdata = np.sum(column_sums)
+		column_variance_rawdata = column_sums.copy()
+
+	if tolerance is None:
+		if relative:
+			tolerance = 1e-8
+		else:
+			tolerance = 1e-9
+
+	P_s = []
+	Z_s = []
+	r_s = []
+	Z_Eigenvalues = []
+	iterations = []
+	R_2 = np.zeros(number_of_components + 1)
+	R_k_2 = np.zeros((number_of_components, number_of_columns))
+	SPE = np.zeros((number_of_components, number_of_rows))
+	T_2 = np.zeros((number_of_components, number_of_rows))
+
+	all_at_once = exact_if_complete and not missing_data
+	if all_at_once:
+		print "No missing values, the components are calculated exactly.\n"
+		all_P, all_eigenvalues = distributed_exact_components(connections, \
+										number_of_components, column_sums)
+
+	for i in range(number_of_components):
+		if all_at_once:
+			ask_all(connections, ('use_score', i))
+			P = all_P[i]
+			length_Z = all_eigenvalues[i]
+			iteration = 0
+		else:
+			P, length_Z, iteration = distributed_iteration(connections, \
+								tolerance, relative, acceleration)
+
+		r = distributed_r(connections)
+		Z = np.concatenate(ask_all(connections, ('get_Z',)))
+
+		P_s.append(np.array([P]))
+		Z_s.append(np.array([Z]))
+		r_s.append(np.array([r]))
+		Z_Eigenvalues.append(length_Z)
+		iterations.append(iteration)
+		print "Eigenvalue of %s. component: %s" % ((i + 1), Z_Eigenvalues[i])
+		print "=================="
+
+		# See nipals_algorithm.deflate().
+		answers = ask_all(connections, ('deflate', P))
+		row_changes = np.concatenate([answer[0] for answer in answers])
+		column_changes = sum(answer[1] for answer in answers)
+
+		new_row_sums = row_sums + row_changes
+		new_column_sums = column_sums + column_changes
+		if na.precision_lost(row_sums, new_row_sums) or \
+							na.precision_lost(column_sums, new_column_sums):
+			answers = ask_all(connections, ('sums',))
+			new_row_sums = np.concatenate([answer[0] for answer in answers])
+			new_column_sums = sum(answer[1] for answer in answers)
+		row_sums, column_sums = new_row_sums, new_column_sums
+
+		R_2[i + 1] = 1 - np.sum(column_sums) / variance_rawdata
+		R_k_2[i] = 1 - column_sums / column_variance_rawdata
+		SPE[i] = np.sqrt(row_sums)
+		T_2[i] = na.calculate_T_2(Z_s[i], T_2[:i])
+
+	Z_merged, P_merged, r_merged = na.create_matrices(Z_s, P_s, r_s, \
+														number_of_components)
+
+	if full_output:
+		info = {'iterations': iterations, 'eigenvalues': Z_Eigenvalues}
+		return Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2, info
+
+	return Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2
+
+
+
+# As nipals_algorithm.exact_components(): The loadings are the eigenvectors
+# of X^T*X, which is just the sum of the X^T*X of each shard. The workers
+# then keep the scores of their rows.
+def distributed_exact_components(connections, number_of_components, \
+															column_sums):
+	gram_matrix = sum(ask_all(connections, ('gram',)))
+
+	eigenvalues, eigenvectors = SLA.eigh(gram_matrix)
+	eigenvalues = eigenvalues[::-1][:number_of_components]
+	P = eigenvectors[:, ::-1][:, :number_of_components].T
+
+	P[na.signs_to_flip(column_sums, P, eigenvalues)] *= -1
+	ask_all(connections, ('project', P))
+
+	return P, eigenvalues
+
+
+
+# As nipals_algorithm.nipals_iteration() for one component. The scores stay
+# with the workers. Returned are the loading, the summed squares of the
+# scores and the number of iterations.
+def distributed_iteration(connections, tolerance, relative, acceleration):
+	# As get_first_score(): start with the column with the largest summed
+	# squares.
+	column_sums = sum(ask_all(connections, ('column_sums',)))
+	index = na.start_column(column_sums)
+	upper_sum, lower_sum, length_Z = ask_sums(connections, ('start', index))
+
+	difference = 1
+	iteration = 0
+	so_many_remembered = 0
+
+	while difference > tolerance:
+		iteration += 1
+
+		P = na.normalize(upper_sum / lower_sum)
+		remember = acceleration == 'aitken'
+		upper_sum, lower_sum, change, length_new_Z = ask_sums(connections, \
+												('step', P, remember))
+
+		if relative:
+			difference = sqrt(change / length_new_Z)
+		else:
+			difference = abs(length_Z - length_new_Z)
+
+		if iteration == 300:
+			na.warn_about_iterations(None, show_plots = False)
+
+		# See nipals_algorithm.aitken_extrapolation(). The sums are needed
+		# from all workers, but each extrapolates its own scores.
+		if remember and difference > tolerance:
+			so_many_remembered += 1
+			if so_many_remembered == 3:
+				squared_change, product = ask_sums(connections, \
+														('aitken_sums',))
+				factor = na.aitken_factor(squared_change, product)
+				if factor is not None:
+					upper_sum, lower_sum, length_new_Z = ask_sums(\
+									connections, ('extrapolate', factor))
+				ask_all(connections, ('forget',))
+				so_many_remembered = 0
+
+		length_Z = length_new_Z
+
+		if iteration > 600:
+			break
+
+	print "So many iterations undertaken:", iteration
+
+	return P, length_Z, iteration
+
+
+
+# As nipals_algorithm.calculate_r_vectorized(), in two rounds: first the
+# means, then the sums around the means.
+def distributed_r(connections):
+	so_many_observed, column_sums, observed_Z, observed_Z_squared = \
+											ask_sums(connections, ('r_sums',))
+	x_dash = column_sums / so_many_observed
+	z_dash = observed_Z / so_many_observed
+
+	upper_sum, first_lower_sum = ask_sums(connections, ('r_second', x_dash))
+	second_lower_sum = observed_Z_squared - so_many_observed * z_dash**2
+
+	return upper_sum / (np.sqrt(first_lower_sum) * np.sqrt(second_lower_sum))
+
+
+
+# What the workers do. state is what serve_shard() keeps, X the zero-filled
+# rows of the worker, M the mask and Z the scores of these rows.
+# The summed squares of each row and each column and if anything is missing.
+def shard_sums(state):
+	squared = state['X']**2
+
+	return squared.sum(axis=1), squared.sum(axis=0), \
+										bool((state['M'] == 0).any())
+
+
+
+def shard_column_sums(state):
+	return (state['X']**2).sum(axis=0)
+
+
+
+# The first Z is a column of data, with NaN's where it is missing (as in
+# nipals_algorithm.get_first_score()). Returned are the sums for the first P.
+def shard_start(state, index):
+	Z = state['X'][:, index].copy()
+	Z[state['M'][:, index] == 0] = np.nan
+	state['Z'] = Z
+	state['history'] = []
+
+	filled_Z = np.where(np.isnan(Z), 0.0, Z)
+
+	return np.dot(state['X'].T, filled_Z), np.dot(state['M'].T, filled_Z**2), \
+															np.nansum(Z**2)
+
+
+
+# The new Z from P and the sums for the next P (see
+# parallel_nipals.fused_step()).
+def shard_step(state, P, remember):
+	X = state['X']
+	M = state['M']
+
+	new_Z = np.dot(X, P) / np.dot(M, P**2)
+	change = np.nansum((new_Z - state['Z'])**2)
+	state['Z'] = new_Z
+	if remember:
+		state['history'].append(new_Z)
+
+	return np.dot(X.T, new_Z), np.dot(M.T, new_Z**2), change, np.sum(new_Z**2)
+
+
+
+def shard_forget(state):
+	state['history'] = []
+
+
+
+def shard_aitken_sums(state):
+	first_difference = state['history'][1] - state['history'][0]
+	second_difference = state['history'][2] - state['history'][1]
+	change = second_difference - first_difference
+
+	return np.dot(change, change), np.dot(second_difference, change)
+
+
+
+def shard_extrapolate(state, factor):
+	second_difference = state['history'][2] - state['history'][1]
+	Z = state['history'][2] - factor * second_difference
+	state['Z'] = Z
+
+	return np.dot(state['X'].T, Z), np.dot(state['M'].T, Z**2), np.sum(Z**2)
+
+
+
+def shard_gram(state):
+	return np.dot(state['X'].T, state['X'])
+
+
+
+def shard_project(state, P):
+	state['all_Z'] = np.dot(P, state['X'].T)
+
+
+
+def shard_use_score(state, i):
+	state['Z'] = state['all_Z'][i].copy()
+
+
+
+def shard_r_sums(state):
+	M = state['M']
+	Z = state['Z']
+
+	return M.sum(axis=0), state['X'].sum(axis=0), np.dot(M.T, Z), \
+															np.dot(M.T, Z**2)
+
+
+
+def shard_r_second(state, x_dash):
+	first_factors = (state['X'] - x_dash) * state['M']
+
+	return np.dot(first_factors.T, state['Z']), np.sum(first_factors**2, axis=0)
+
+
+
+def shard_get_Z(state):
+	return state['Z']
+
+
+
+# See nipals_algorithm.deflate().
+def shard_deflate(state, P):
+	X = state['X']
+	M = state['M']
+	Z = state['Z']
+
+	squared_P = P**2
+	row_changes = Z**2 * np.dot(M, squared_P) - 2 * Z * np.dot(X, P)
+	column_changes = squared_P * np.dot(M.T, Z**2) - 2 * P * np.dot(X.T, Z)
+
+	X -= np.outer(Z, P) * M
+
+	return row_changes, column_changes
+
+
+
+COMMANDS = {'sums': shard_sums, 'column_sums': shard_column_sums, \
+			'start': shard_start, 'step': shard_step, 'forget': shard_forget, \
+			'aitken_sums': shard_aitken_sums, \
+			'extrapolate': shard_extrapolate, 'gram': shard_gram, \
+			'project': shard_project, 'use_score': shard_use_score, \
+			'r_sums': shard_r_sums, 'r_second': shard_r_second, \
+			'get_Z': shard_get_Z, 'deflate': shard_deflate}
@@ -0,0 +1,167 @@
+#    "PCA" (v0.7)
+#    Copyright 2016 Soren Heinze
+#    soerenheinze@gmx.de
+#    5B1C 1897 560A EF50 F1EB 2579 2297 FAE4 D9B5 2A35
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# If new data arrives all the time, it would be a pity to read and fit all
+# of the old data again and again. Here just a small summary of everything
+# seen so far is kept (the "state"): the moments of each column (see
+# data_preprocessing.column_moments()) and the summed products of all pairs
+# of columns around their means (the "comoment", variables x variables).
+# Each new block of rows is merged into this and then forgotten.
+# The loadings are the eigenvectors of the preprocessed comoment. Thus, each
+# update needs the same time, no matter how much data came before.
+#
+# state = start_incremental(len(variables), 3)
+# for labels, block in blocks:
+#     update(state, block)
+#     P, eigenvalues, R_2, transform = incremental_components(state)
+#
+# The loadings are the same as from nipals_pca(..., exact_if_complete = True)
+# for all the data seen so far, if no value is missing.
+
+import numpy as np
+from scipy import linalg as SLA
+import data_preprocessing as dp
+import nipals_algorithm as na
+
+# these_processes and enhance_these are the same as for
+# data_preprocessing.get_transform(). They can't change later, since the
+# comoment is stored without preprocessing but the components are
+# calculated from the preprocessed one.
+#
+# forgetting is the factor all that was seen before is weighted with, each
+# time a new block arrives. 1 (default) means that all rows count the same.
+# With e.g. 0.9 a block that arrived 10 blocks ago counts just about a third
+# (0.9**10) of the newest one. Thus, the components follow slowly changing
+# data.
+def start_incremental(number_of_columns, number_of_components, \
+					these_processes = '', enhance_these = '', forgetting = 1.0):
+	return {'number_of_components': number_of_components, \
+			'these_processes': these_processes, \
+			'enhance_these': enhance_these, 'forgetting': forgetting, \
+			'moments': (np.zeros(number_of_columns), \
+						np.zeros(number_of_columns), np.zeros(number_of_columns)), \
+			'weight': 0.0, 'mean': np.zeros(number_of_columns), \
+			'comoment': np.zeros((number_of_columns, number_of_columns))}
+
+
+
+# Merges a block of rows (not preprocessed, NaN's are allowed) into state,
+# which is changed in place.
+# The moments of each column ignore NaN's, just as in data_preprocessing.
+# For the comoment a missing value is replaced by the mean of its column in
+# this block, thus it doesn't add anything to the products of its column.
+# Merging works the same way as data_preprocessing.merge_moments(), just
+# with the products of two columns instead of the squares of one.
+def update(state, block):
+	block = np.asarray(block, dtype = np.float64)
+	if block.ndim == 1:
+		block = block[np.newaxis, :]
+	if block.shape[0] == 0:
+		return state
+
+	forgetting = state['forgetting']
+	count, mean, centered_sums = state['moments']
+	old_moments = (forgetting * count, mean, forgetting * centered_sums)
+	new_moments = dp.block_moments(block)
+	state['moments'] = dp.merge_moments(old_moments, new_moments)
+
+	# Columns of which nothing is observed in this block get the mean so far.
+	so_many_observed, block_mean, block_sums = new_moments
+	block_mean = np.where(so_many_observed > 0, block_mean, state['mean'])
+
+	centered = np.where(np.isnan(block), 0.0, block - block_mean)
+	block_comoment = np.dot(centered.T, centered)
+
+	weight_a = forgetting * state['weight']
+	weight_b = float(block.shape[0])
+	weight = weight_a + weight_b
+	delta = block_mean - state['mean']
+
+	state['comoment'] = forgetting * state['comoment'] + block_comoment + \
+							np.outer(delta, delta) * weight_a * weight_b / weight
+	state['mean'] = state['mean'] + delta * weight_b / weight
+	state['weight'] = weight
+
+	return state
+
+
+
+# The preprocessing of all data seen so far, see
+# data_preprocessing.transform_from_moments().
+def incremental_transform(state):
+	return dp.transform_from_moments(state['these_processes'], \
+									state['enhance_these'], state['moments'])
+
+
+
+# The loadings (one per line), eigenvalues (the summed squares of the scores,
+# as in nipals_pca()) and R_2 (the explained variance, starting with 0 as in
+# nipals_pca()) of all data seen so far. And the transform the data needs to
+# be preprocessed with to get the scores (np.dot(preprocessed data, P.T)).
+# The signs are chosen as exact_components() in nipals_algorithm does it.
+def incremental_components(state):
+	transform = incremental_transform(state)
+	factor = transform['boost'] / transform['scale']
+
+	comoment = state['comoment']
+	if state['these_processes'] == '0':
+		# Not centered, so the products are summed around 0.
+		comoment = comoment + state['weight'] * \
+									np.outer(state['mean'], state['mean'])
+	comoment = comoment * np.outer(factor, factor)
+
+	number_of_components = state['number_of_components']
+	eigenvalues, eigenvectors = SLA.eigh(comoment)
+	eigenvalues = eigenvalues[::-1][:number_of_components]
+	P = eigenvectors[:, ::-1][:, :number_of_components].T
+
+	# See nipals_algorithm.align_signs(), the diagonal are the summed squares
+	# of each column.
+	P[na.signs_to_flip(np.diag(comoment), P, eigenvalues)] *= -1
+
+	R_2 = np.zeros(number_of_components + 1)
+	R_2[1:] = np.cumsum(eigenvalues) / np.trace(comoment)
+
+	return P, eigenvalues, R_2, transform
+
+
+
+# A model like pca_model.build_model() returns, so that new observations
+# can be projected with pca_model.project().
+# The standard deviation of the scores follows from the eigenvalues (the 
+# summed squares of the scores) and the mean of the scores, which is zero 
+# if the data is centered.
+def incremental_model(state, variables = None):
+	P, eigenvalues, R_2, transform = incremental_components(state)
+
+	factor = transform['boost'] / transform['scale']
+	score_mean = np.dot(P, (state['mean'] - transform['mean']) * factor)
+	score_variance = eigenvalues / state['weight'] - score_mean**2
+
+	variance, column_variances = dp.reference_variances(transform)
+	model = {'loadings': P, \
+			'score_std': np.sqrt(np.clip(score_variance, 0, None)), \
+			'eigenvalues': eigenvalues, 'mean': transform['mean'], \
+			'number_of_observations': state['weight'], \
+			'scale': transform['scale'], 'boost': transform['boost'], \
+			'reference_variances': column_variances}
+
+	if variables is not None:
+		model['variables'] = list(variables)
+
+	return model
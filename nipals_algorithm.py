@@ -31,11 +31,108 @@ from scipy import linalg as SLA
 from math import sqrt
 from copy import deepcopy
 import plotting as pl
+import parallel_nipals as pn
 
 # Returned are the loadings, scores, the Hotelling's T^2, the square prediction 
 # error per variable (SPE), the variance per column (R_k^2) and how much
 # of the variance is explained by each component (R_2)
-def nipals_pca(data, rawdata, number_of_components):
+# 
+# R_2 and R_k_2 are relative to the summed squares of the preprocessed data
+# (all together and per column). These are calculated from rawdata (which 
+# is the preprocessed data, too) if given. Otherwise they are given as 
+# reference_variances (see data_preprocessing.reference_variances()) or, if 
+# neither is given, they are calculated from data itself before anything is 
+# done. 
+# 
+# engine decides how the sums in the NIPALS iteration are calculated:
+# 'vectorized' (default) does them with whole-array numpy operations on a
+# copy of the data in which missing values are set to zero, together with a
+# mask that says where the data actually was observed.
+# 'loops' is the original "by hand" implementation. Both give the same 
+# results, but the vectorized one is much, much faster.
+# 
+# If the data contains no missing values at all, there is no need for the 
+# iteration. Then the components are calculated exactly from the 
+# eigenvectors of the (smaller) Gram matrix, see exact_components().
+# exact_if_complete = False switches this off.
+# 
+# engine = 'block' doesn't extract one component after the other but all of
+# them at the same time, see block_components(). 
+# engine = 'impute' fills in the missing values with the model itself, see 
+# impute_components().
+# engine = 'randomized' is for very large matrices if just a few components 
+# are wanted, see randomized_components(). Missing values are filled in the 
+# same way as for 'impute'. This engine is used even if nothing is missing.
+# 
+# tolerance, relative and acceleration are handed over to nipals_iteration().
+# 
+# With full_output = True a dictionary with some more information is 
+# returned as the last element: 
+# 'iterations' are the iterations needed per component (for the engines 
+# that find all components at once, this is the number for all of them).
+# 'eigenvalues' are the summed squares of each score vector.
+# 'residual' is the data after all found components were subtracted.
+# 
+# A model that was fitted before can be extended by more components. For this
+# previous needs to be what nipals_pca() returned for the same data (and 
+# rawdata) and number_of_components is the total number of components 
+# wanted. The components found before are not calculated again. If previous 
+# was returned with full_output = True the residual is taken from it, 
+# otherwise it is calculated from the scores and loadings.
+# 
+# initial_loadings (one loading per line) are used as the start for the 
+# first components instead of get_first_score(). If the data changed just a
+# little since the loadings were found, NIPALS needs just a few iterations.
+# 
+# in_place = True is for data that just fits into memory. Then no copy of 
+# data is made at all: The residual is calculated in data itself (which is 
+# thus changed!) and everything is done in blocks of block_size rows, with 
+# the same few small buffers for all components. See make_workspace().
+# This works with the 'vectorized' engine (and if nothing is missing).
+# 
+# For data that does not fit into memory at all, scratch_file is the name of 
+# a .npy file on the disk. data (and rawdata) can then be memory mapped 
+# arrays (e.g. from np.load(..., mmap_mode = 'r')). The residual is 
+# calculated in scratch_file, everything is done in blocks of rows as for 
+# in_place, but not even a mask of the missing values is kept in memory. 
+# data is not changed. The residual in full_output is the memory mapped 
+# scratch_file.
+# 
+# data can be np.float32 (see read_data.read_data(..., dtype = np.float32)).
+# Then the residual is np.float32, too, and needs half the memory. But all
+# sums are calculated as np.float64: everything is done in blocks as for 
+# in_place (this works just with engine = 'vectorized') and each block is 
+# converted into a np.float64 buffer first. Scores, loadings and all 
+# diagnostics are np.float64.
+# Hence, the only error compared to np.float64 data comes from storing the 
+# numbers with 24 instead of 53 bits. Each value (and each value of the 
+# residual after each component) is off by at most 2**-24 (6e-8) relative 
+# to its size. Thus the residual after k components is off by at most about 
+# (k + 1) * 6e-8 * max(abs(data)). A loading moves by about 6e-8 times the 
+# size of the data relative to how far its eigenvalue is from the next one 
+# (well separated components: better than 1e-6), and R_2, R_k_2, SPE and 
+# T_2 are good to about 1e-6 as well. If two components have almost the same
+# eigenvalue, they can mix more, as they do for any small change of the data.
+# 
+# show_plots = False doesn't plot the scores if NIPALS needs very many 
+# iterations (see nipals_iteration()), e.g. if no one is there to look at 
+# them.
+# 
+# engine = 'parallel' is the same as 'vectorized', but the sums are 
+# calculated by workers processes (default: as many as there are cores) at
+# the same time, each for a part of the rows. See parallel_nipals.py.
+def nipals_pca(data, rawdata, number_of_components, engine = 'vectorized', \
+				exact_if_complete = True, tolerance = None, relative = True, \
+				acceleration = None, full_output = False, previous = None, \
+				initial_loadings = None, in_place = False, block_size = None, \
+				scratch_file = None, reference_variances = None, \
+				show_plots = True, workers = None):
+	# This is checked first, before e.g. scratch_file is written.
+	if (in_place or scratch_file is not None or data.dtype == np.float32) \
+											and engine != 'vectorized':
+		raise ValueError("in_place, scratch_file and np.float32 data work " + \
+										"just with engine = 'vectorized'")
+
 	# Later I want the Loading- and Score-vectors all in an array.
 	# Due to how numpy works when just line/column-vectors are involved
 	# I have to work a bit to get this array.
@@ -46,92 +143,594 @@ def nipals_pca(data, rawdata, number_of_components):
 	Z_s = []
 	r_s = []
 	Z_Eigenvalues = []
+	iterations = []
+
+	# The diagnostics are arrays right from the start. Line i belongs to 
+	# component i + 1.
+	number_of_rows, number_of_columns = data.shape
 
 	# This is for the variance after each Z is found.
 	# This shows how much of the data the cumulative Z's explain.
-	R_2 = [0]
+	# The first element is zero.
+	R_2 = np.zeros(number_of_components + 1)
 
 	# This is for the variance of each column after each Z is found
-	R_k_2 = []
+	R_k_2 = np.zeros((number_of_components, number_of_columns))
 
 	# This is for the square prediction error.
-	SPE = []
+	SPE = np.zeros((number_of_components, number_of_rows))
 
 	# This is for the Hotelling's T_2 value.
-	T_2 = []
-
-	variance_rawdata, column_variance_rawdata = raw_data_variances(rawdata)
+	T_2 = np.zeros((number_of_components, number_of_rows))
 
-	for i in range(number_of_components):
-		first_Z, length_Z = get_first_score(data)
+	if reference_variances is not None:
+		variance_rawdata, column_variance_rawdata = reference_variances
+	elif rawdata is not None:
+		variance_rawdata, column_variance_rawdata = raw_data_variances(rawdata)
+	else:
+		variance_rawdata, column_variance_rawdata = raw_data_variances(data)
+
+	# The components that were already found before.
+	already_found = 0
+	if previous is not None:
+		data, already_found = continue_from(previous, data, P_s, Z_s, r_s, \
+								Z_Eigenvalues, iterations, R_2, R_k_2, SPE, T_2)
+
+	# The processes of engine = 'parallel' are needed just for the iteration,
+	# not if the components are calculated exactly.
+	use_pool = engine == 'parallel' and \
+					(not exact_if_complete or any_missing(data, block_size))
+
+	# The residual is calculated in data. If this shall not change the data 
+	# of the caller, a copy is needed. But just this one.
+	if scratch_file is not None:
+		data = copy_to_scratch(data, scratch_file, block_size)
+	elif not in_place and not use_pool:
+		data = data.copy()
+
+	if initial_loadings is not None:
+		initial_loadings = np.atleast_2d(initial_loadings)
+	else:
+		initial_loadings = np.zeros((0, data.shape[1]))
+
+	if scratch_file is not None:
+		workspace = make_workspace(data, block_size, keep_nans = True)
+		missing_data = any_missing(data, block_size)
+	elif in_place or data.dtype == np.float32:
+		workspace = make_workspace(data, block_size)
+		missing_data = not workspace['observed'].all()
+	elif use_pool:
+		# The copy of data is made here, in shared memory.
+		workspace, data = pn.make_parallel_workspace(data, workers, block_size)
+		missing_data = not workspace['observed'].all()
+	else:
+		workspace = None
+		missing_data = np.isnan(data).any()
+
+	# ATTENTION: The processes of engine = 'parallel' have to be stopped, 
+	# whatever happens (e.g. an error or Ctrl-C).
+	try:
+		# The summed squares of each row and column of the residual. These are 
+		# needed for the diagnostics and will be updated with each component.
+		row_sums, column_sums = sums_of_squares(data, block_size)
+
+		# Some engines calculate all components at once. Scores and loadings are
+		# then just taken from these, everything else is the same as for NIPALS.
+		all_at_once = False
+		if exact_if_complete and engine not in ['loops', 'randomized'] and \
+															not missing_data:
+			print "No missing values, the components are calculated exactly.\n"
+			all_Z, all_P, all_eigenvalues = exact_components(data, \
+										number_of_components - already_found)
+			all_iterations = 0
+			all_at_once = True
+		elif engine == 'block':
+			all_Z, all_P, all_eigenvalues, all_iterations = block_components(\
+							data, number_of_components - already_found, \
+							initial_loadings = initial_loadings)
+			all_at_once = True
+		elif engine == 'impute':
+			all_Z, all_P, all_eigenvalues, all_iterations = impute_components(\
+							data, number_of_components - already_found)
+			all_at_once = True
+		elif engine == 'randomized':
+			if missing_data:
+				all_Z, all_P, all_eigenvalues, all_iterations = impute_components(\
+							data, number_of_components - already_found, \
+							components = randomized_components)
+			else:
+				all_Z, all_P, all_eigenvalues = randomized_components(data, \
+										number_of_components - already_found)
+				all_iterations = 0
+			all_at_once = True
+
+		for i in range(already_found, number_of_components):
+			if all_at_once:
+				Z = all_Z[i - already_found:i - already_found + 1]
+				P = all_P[i - already_found:i - already_found + 1]
+				if workspace is not None:
+					r = np.array([calculate_r_blocked(data, workspace, Z[0])])
+				else:
+					r = np.array([correlation_loadings(data, Z[0], missing_data)])
+				length_Z = all_eigenvalues[i - already_found]
+				iteration = all_iterations
+			else:
+				if i - already_found < len(initial_loadings):
+					first_Z, length_Z = score_from_loading(data, \
+								initial_loadings[i - already_found], workspace)
+				else:
+					first_Z, length_Z = get_first_score(data)
+
+				Z, P, r, length_Z, iteration = nipals_iteration(data, first_Z, \
+										length_Z, engine, tolerance, relative, \
+										acceleration, workspace, show_plots)
+
+			P_s.append(P)
+			Z_s.append(Z)
+			r_s.append(r)
+			Z_Eigenvalues.append(length_Z)
+			iterations.append(iteration)
+			print "Eigenvalue of %s. component: %s" % ((i + 1), Z_Eigenvalues[i])
+			print "=================="
+
+			# Now get the residual E by substracting from the original data the 
+			# data constructed from the Score and load vector that were calculated 
+			# above.
+			# This will be the new data.
+			# How the summed squares change is calculated on the way, so that the 
+			# residual does not have to be summed up again. Unless that would be
+			# too inexact, see precision_lost().
+			row_changes, column_changes = deflate(data, Z[0], P[0], workspace, \
+																	block_size)
+			new_row_sums = row_sums + row_changes
+			new_column_sums = column_sums + column_changes
+			if precision_lost(row_sums, new_row_sums) or \
+								precision_lost(column_sums, new_column_sums):
+				new_row_sums, new_column_sums = sums_of_squares(data, block_size)
+			row_sums, column_sums = new_row_sums, new_column_sums
+
+			# Get R_2 for this component.
+			R_2[i + 1] = 1 - np.sum(column_sums) / variance_rawdata
+
+			# Get R_k_2 for this component.
+			R_k_2[i] = 1 - column_sums / column_variance_rawdata
+
+			# Get the SPE for this component.
+			SPE[i] = np.sqrt(row_sums)
+
+			# Get the T_2 for this component.
+			T_2[i] = calculate_T_2(Z, T_2[:i])
+
+		# When all components are found, merge all the Load- and Score-vectors 
+		# into the respective matrix.
+		Z_merged, P_merged, r_merged = create_matrices(Z_s, P_s, r_s, \
+															number_of_components)
+
+		# The residual shall look like the data again.
+		if workspace is not None and workspace['observed'] is not None:
+			np.copyto(data, np.nan, where = workspace['observed'] == 0)
+	finally:
+		if use_pool:
+			pn.close_parallel_workspace(workspace)
+
+	if scratch_file is not None:
+		data.flush()
 
-		Z, P, r, length_Z = nipals_iteration(data, first_Z, length_Z)
+	# The end result of the whole shebang.
+	if full_output:
+		info = {'iterations': iterations, 'eigenvalues': Z_Eigenvalues, \
+														'residual': data}
+		return Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2, info
 
-		P_s.append(P)
-		Z_s.append(Z)
-		r_s.append(r)
-		Z_Eigenvalues.append(length_Z)
-		print "Eigenvalue of %s. component: %s" % ((i + 1), Z_Eigenvalues[i])
-		print "=================="
+	return Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2
 
-		# Now get the residual E by substracting from the original data the 
-		# data constructed from the Score and load vector that were calculated 
-		# above.
-		# This will be the new data.
-		data = data - np.dot(Z.T, P)
 
-		# Get R_2 for this component.
-		R_2.append(calculate_R_2(data, variance_rawdata))
 
-		# Get R_k_2 for this component.
-		R_k_2.append(calculate_R_k_2(data, column_variance_rawdata))
+# This is to keep nipals_pca() more tidy.
+# Everything that was found before is put into the lists and arrays of 
+# nipals_pca(), which are changed in place. Returned are the residual and how
+# many components were already found.
+def continue_from(previous, data, P_s, Z_s, r_s, Z_Eigenvalues, iterations, \
+												R_2, R_k_2, SPE, T_2):
+	Z_merged, P_merged, r_merged, old_R_2, old_R_k_2, old_SPE, old_T_2 = \
+															previous[:7]
+	already_found = Z_merged.shape[0]
 
-		# Get the SPE for this component.
-		SPE.append(calculate_SPE(data))
+	if len(previous) > 7:
+		info = previous[7]
+		residual = info['residual']
+		Z_Eigenvalues.extend(info['eigenvalues'])
+		iterations.extend(info['iterations'])
+	else:
+		residual = data - np.dot(Z_merged.T, P_merged)
+		Z_Eigenvalues.extend(np.sum(Z_merged**2, axis=1))
+		iterations.extend([0] * already_found)
 
-		# Get the T_2 for this component.
-		T_2.append(calculate_T_2(Z, T_2))
+	for i in range(already_found):
+		P_s.append(P_merged[i:i + 1])
+		Z_s.append(Z_merged[i:i + 1])
+		r_s.append(r_merged[i:i + 1])
 
-	# When all components are found, merge all the Load- and Score-vectors 
-	# into the respective matrix.
-	Z_merged, P_merged, r_merged = create_matrices(Z_s, P_s, r_s, \
-														number_of_components)
+	R_2[:already_found + 1] = old_R_2
+	R_k_2[:already_found] = old_R_k_2
+	SPE[:already_found] = old_SPE
+	T_2[:already_found] = old_T_2
 
-	# The end result of the whole shebang.
-	return Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2
+	return residual, already_found
 
 
 
 # To calculate the residuals/errors I need to know the variance of the raw data.
 # This is mainly to keep nipals_pca() more tidy.
 def raw_data_variances(rawdata):
-	variance_rawdata = np.nansum(rawdata*rawdata)
-
-	column_variance_rawdata = []
-	for i in range(rawdata.shape[1]):
-		column_variance_rawdata.append(np.nansum(rawdata[:,i]*rawdata[:,i]))
+	row_sums, column_variance_rawdata = sums_of_squares(rawdata)
+	variance_rawdata = np.sum(column_variance_rawdata)
 
 	return variance_rawdata, column_variance_rawdata
 
 
 
+# The summed squares of each row and each column of data, ignoring NaN's.
+# This is done in blocks of rows, so that data*data is never needed in full.
+# The squares are np.float64, whatever data is.
+def sums_of_squares(data, block_size = None):
+	if block_size is None:
+		block_size = default_block_size(data)
+
+	row_sums = np.zeros(data.shape[0])
+	column_sums = np.zeros(data.shape[1])
+	for start in range(0, data.shape[0], block_size):
+		squared = np.asarray(data[start:start + block_size], \
+												dtype = np.float64)**2
+		squared[np.isnan(squared)] = 0
+
+		row_sums[start:start + block_size] = squared.sum(axis=1)
+		column_sums += squared.sum(axis=0)
+
+	return row_sums, column_sums
+
+
+
+# The summed squares after a component are the ones before plus the changes
+# of deflate(). The rounding error of this is about 1e-16 times the summed 
+# squares BEFORE. If a component explains almost everything of a row or 
+# column (e.g. the first component of data that is not mean centered), the 
+# summed squares become much smaller and the error is large compared to 
+# them. Then the residual is summed up again (which is exact, but needs one 
+# more pass over the data).
+# With the limit of 1e-4 all summed squares are good to about 1e-12.
+def precision_lost(old_sums, new_sums):
+	return np.any(new_sums < 1e-4 * old_sums)
+
+
+
+# So many rows that a block has about a million elements (8 MB).
+def default_block_size(data):
+	return max(1, 2**20 // max(1, data.shape[1]))
+
+
+
+# If no values are missing the components are the eigenvectors of X^T*X (the
+# loadings) and the scores are X*P. If there are more variables than 
+# observations it is cheaper to get the eigenvectors of X*X^T (the normalized 
+# scores) and calculate the loadings from these.
+# Either way, the loadings are normalized to length one, just as in 
+# nipals_iteration(), and the eigenvalue is the summed squares of the score 
+# vector, just as length_Z in NIPALS.
+# 
+# An eigenvector is just defined up to its sign. NIPALS starts with the column 
+# with the largest summed squares. Hence, its loading will be positive, and 
+# this is what is done here, too, to get the same signs as NIPALS.
+# align = False skips this, if just the space of the components matters.
+def exact_components(data, number_of_components, align = True):
+	number_of_rows, number_of_columns = data.shape
+
+	if number_of_rows >= number_of_columns:
+		# Block by block, in case data is on the disk.
+		block_size = default_block_size(data)
+		gram_matrix = np.zeros((number_of_columns, number_of_columns))
+		for start in range(0, number_of_rows, block_size):
+			block = np.asarray(data[start:start + block_size], \
+												dtype = np.float64)
+			gram_matrix += np.dot(block.T, block)
+
+		eigenvalues, eigenvectors = SLA.eigh(gram_matrix)
+		# eigh() returns the eigenvalues in ascending order.
+		eigenvalues = eigenvalues[::-1][:number_of_components]
+		P = eigenvectors[:, ::-1][:, :number_of_components].T
+
+		Z = np.empty((len(eigenvalues), number_of_rows))
+		for start in range(0, number_of_rows, block_size):
+			Z[:, start:start + block_size] = np.dot(P, np.asarray(\
+						data[start:start + block_size], dtype = np.float64).T)
+	else:
+		# The same block by block, each pair of blocks gives one part of 
+		# X*X^T. Thus np.float32 data is summed as np.float64, too.
+		block_size = default_block_size(data)
+		gram_matrix = np.zeros((number_of_rows, number_of_rows))
+		for start in range(0, number_of_rows, block_size):
+			block = np.asarray(data[start:start + block_size], \
+												dtype = np.float64)
+			for other_start in range(0, number_of_rows, block_size):
+				other_block = np.asarray(data[other_start:other_start + \
+									block_size], dtype = np.float64)
+				gram_matrix[start:start + block_size, \
+							other_start:other_start + block_size] = \
+											np.dot(block, other_block.T)
+
+		eigenvalues, eigenvectors = SLA.eigh(gram_matrix)
+		eigenvalues = eigenvalues[::-1][:number_of_components]
+		U = eigenvectors[:, ::-1][:, :number_of_components].T
+		singular_values = np.sqrt(np.clip(eigenvalues, 0, None))
+		Z = U * singular_values[:, np.newaxis]
+
+		P = np.zeros((len(eigenvalues), number_of_columns))
+		for start in range(0, number_of_rows, block_size):
+			P += np.dot(U[:, start:start + block_size], np.asarray(\
+						data[start:start + block_size], dtype = np.float64))
+		P = P / singular_values[:, np.newaxis]
+
+	if align:
+		align_signs(data, Z, P, eigenvalues)
+
+	return Z, P, eigenvalues
+
+
+
+# The same as exact_components(), but with a randomized truncated SVD 
+# (Halko, Martinsson and Tropp, 2011): data is multiplied with a few more 
+# random vectors than components are wanted (oversampling). The result spans
+# (almost) the same space as the largest components. power_iterations 
+# multiplications with data*data^T make this much more exact if the 
+# eigenvalues decrease slowly. In this small space the SVD is cheap.
+# Everything else is just a few multiplications with data, hence the time 
+# needed grows just linearly with the number of rows.
+# seed makes sure that the same data always gives the same components.
+def randomized_components(data, number_of_components, align = True, \
+						oversampling = 10, power_iterations = 4, seed = 0):
+	so_many = min(number_of_components + oversampling, min(data.shape))
+
+	random_state = np.random.RandomState(seed)
+	Q = np.dot(data, random_state.normal(size = (data.shape[1], so_many)))
+	Q, R = np.linalg.qr(Q)
+
+	# After each multiplication the vectors are orthonormalized again, 
+	# otherwise all of them would become the largest component.
+	for i in range(power_iterations):
+		Q, R = np.linalg.qr(np.dot(data.T, Q))
+		Q, R = np.linalg.qr(np.dot(data, Q))
+
+	U, singular_values, P = np.linalg.svd(np.dot(Q.T, data), \
+													full_matrices = False)
+	U = np.dot(Q, U[:, :number_of_components])
+	singular_values = singular_values[:number_of_components]
+
+	Z = (U * singular_values).T
+	P = P[:number_of_components]
+	eigenvalues = singular_values**2
+
+	if align:
+		align_signs(data, Z, P, eigenvalues)
+
+	return Z, P, eigenvalues
+
+
+
+# Flips the signs of the components calculated at once such that the loading
+# of the column NIPALS would have started with is positive (see 
+# exact_components()).
+# Z and P are changed in place.
+def align_signs(data, Z, P, eigenvalues):
+	row_sums, summed = sums_of_squares(data)
+	flip = signs_to_flip(summed, P, eigenvalues)
+	P[flip] *= -1
+	Z[flip] *= -1
+
+
+
+# Which components of align_signs() need to be flipped. summed are the 
+# summed squares of each column of the data.
+def signs_to_flip(summed, P, eigenvalues):
+	flip = np.zeros(len(eigenvalues), dtype = bool)
+	for i in range(len(eigenvalues)):
+		index = start_column(summed)
+		flip[i] = P[i, index] < 0
+
+		# The summed squares of each column of the residual after this 
+		# component. This is the same as what get_first_score() would 
+		# calculate.
+		summed = summed - eigenvalues[i] * P[i]**2
+
+	return flip
+
+
+
+# This is the "block" version of NIPALS: All loadings are found at the same 
+# time by alternating least squares. With the loadings fixed, the best scores
+# of each row are calculated just from the observed values of this row. Then,
+# with the scores fixed, the same is done for the loadings of each column. 
+# After each step the loadings are orthogonalized. 
+# Thus, the number of iterations is about the same as for one NIPALS 
+# component, regardless how many components are wanted.
+# 
+# In the end the found subspace is rotated such that the first component 
+# explains the most, the second component the second most etc. 
+# Without missing values the result is the same as from the one-by-one 
+# NIPALS. With missing values it is usually very close but not necessarily 
+# identical, since NIPALS fits each component to the residual of the 
+# components before.
+# 
+# initial_loadings (one per line) are used as the start for the first 
+# components, if given.
+def block_components(data, number_of_components, tolerance = 1e-12, \
+							max_iterations = 600, initial_loadings = None):
+	observed, filled_data = get_observed_and_filled(data)
+
+	# Start with the columns with the largest summed squares, just as NIPALS.
+	# Any other start would work, too. But these are usually already close.
+	summed = np.sum(filled_data**2, axis=0)
+	start_columns = np.argsort(summed)[::-1][:number_of_components]
+	start = np.dot(filled_data.T, filled_data[:, start_columns])
+	if initial_loadings is not None:
+		so_many = min(len(initial_loadings), number_of_components)
+		start[:, :so_many] = initial_loadings[:so_many].T
+	Q, R = np.linalg.qr(start)
+	P = Q.T
+
+	iteration = 0
+	converged = False
+	while iteration < max_iterations:
+		iteration += 1
+
+		Z = masked_least_squares(filled_data, observed, P)
+		new_P = masked_least_squares(filled_data.T, observed.T, Z)
+
+		# Orthogonalize the loadings. Z^T*P must not change, hence Z is 
+		# multiplied with R.
+		Q, R = np.linalg.qr(new_P.T)
+		new_P = Q.T
+		Z = np.dot(R, Z)
+
+		# If the old and the new loadings span the same space, all singular 
+		# values of P_new*P^T are one (the cosines of the angles between 
+		# the spaces).
+		cosines = np.linalg.svd(np.dot(new_P, P.T), compute_uv = False)
+		P = new_P
+
+		if 1 - np.min(cosines) < tolerance:
+			converged = True
+			break
+
+	print "So many iterations undertaken:", iteration
+	if not converged:
+		warn_not_converged(iteration)
+
+	# Now rotate the subspace such that the components are sorted by how 
+	# much they explain.
+	U, singular_values, W_T = np.linalg.svd(Z.T, full_matrices = False)
+	Z = (U * singular_values).T
+	P = np.dot(W_T, P)
+	eigenvalues = singular_values**2
+
+	align_signs(data, Z, P, eigenvalues)
+
+	return Z, P, eigenvalues, iteration
+
+
+
+# This is NOT NIPALS but an EM-like algorithm ("iterative SVD"): The missing
+# values are filled in with the column means, then the components are 
+# calculated exactly as if nothing was missing. The missing values are 
+# replaced by what these components predict, the components are calculated 
+# again and so on, until the filled in values don't change anymore.
+# 
+# For large matrices with not too many missing values this converges in a 
+# few dozen iterations and each iteration is just one eigendecomposition of
+# the Gram matrix. The missing values are just used to find the components, 
+# all diagnostics in nipals_pca() are calculated just from the observed 
+# values, as usual.
+# The filled in values are compared relative to the length of all data.
+def impute_components(data, number_of_components, tolerance = 1e-8, \
+							max_iterations = 600, components = exact_components):
+	observed = ~np.isnan(data)
+	missing_rows, missing_columns = np.nonzero(~observed)
+
+	filled_data = np.where(observed, data, 0.0)
+	column_means = filled_data.sum(axis=0) / np.maximum(observed.sum(axis=0), 1)
+	filled_data[missing_rows, missing_columns] = column_means[missing_columns]
+
+	length_data = sqrt(np.sum(filled_data**2))
+
+	iteration = 0
+	converged = False
+	while iteration < max_iterations:
+		iteration += 1
+
+		Z, P, eigenvalues = components(filled_data, number_of_components, \
+															align = False)
+
+		# Just the missing elements of Z^T*P are needed.
+		predicted = np.sum(Z[:, missing_rows] * P[:, missing_columns], axis=0)
+		difference = sqrt(np.sum((predicted - \
+				filled_data[missing_rows, missing_columns])**2)) / length_data
+		filled_data[missing_rows, missing_columns] = predicted
+
+		if difference < tolerance:
+			converged = True
+			break
+
+	print "So many iterations undertaken:", iteration
+	if not converged:
+		warn_not_converged(iteration)
+
+	align_signs(data, Z, P, eigenvalues)
+
+	return Z, P, eigenvalues, iteration
+
+
+
+# The same as warn_about_iterations(), for the engines that find all 
+# components at once (block_components() and impute_components()). If they 
+# stop because of max_iterations, the components are not what they should 
+# be and the user needs to know this.
+def warn_not_converged(iteration):
+	print "\n After %s iterations the components have still not " % iteration
+	print "converged and may be far from the right ones. Try fewer "
+	print "components, check the data for extreme outliers or use the "
+	print "default engine.\n"
+
+
+
+# For each row of filled_data this gives the vector z that minimizes
+# sum((row - z*P)**2) over the observed elements of the row:
+# (P_obs * P_obs^T) * z = P_obs * row_obs.
+# All the small (components x components) systems are solved at once.
+# Called with the transposed data and the scores it gives the loadings.
+def masked_least_squares(filled_data, observed, P):
+	number_of_components = P.shape[0]
+
+	right_side = np.dot(filled_data, P.T)
+
+	# The outer products p_j*p_j^T of each column, summed over the observed 
+	# columns of each row.
+	outer_products = (P[:, np.newaxis, :] * P[np.newaxis, :, :]).reshape(\
+										number_of_components**2, -1)
+	left_side = np.dot(observed, outer_products.T).reshape(-1, \
+								number_of_components, number_of_components)
+
+	# A row with fewer observed values than components has no unique 
+	# solution. A tiny ridge makes sure that the system can still be solved.
+	ridge = 1e-12 * np.trace(left_side, axis1=1, axis2=2) + 1e-300
+	left_side += ridge[:, np.newaxis, np.newaxis] * np.eye(number_of_components)
+
+	return np.linalg.solve(left_side, right_side[:, :, np.newaxis])[:, :, 0].T
+
+
+
+# Just to keep nipals_pca() a bit more tidy.
+# The correlation loadings for components that were calculated all at once.
+def correlation_loadings(data, Z, missing_data):
+	if missing_data:
+		observed, filled_data = get_observed_and_filled(data)
+		return calculate_r_vectorized(filled_data, observed, Z)
+	else:
+		return calculate_r_vectorized(data, None, Z)
+
+
+
 # For each iteration I need a first score vector to start with.
 # This could be (almost) everything, but I've heard that the method used here 
 # get's closer to the final vector and, well, why not ;) .
 def get_first_score(data):
-	# Compute the summed squares.
-	# This is the matrix in which each element is squared
-	squared = data*data
-	# Now sum up all elements in each column.
-	summed = np.nansum(squared, axis=0)
+	# Compute the summed squares of all elements in each column.
+	row_sums, summed = sums_of_squares(data)
 
-	# Since this is a line-vector, argmax returns the index 
-	# of the maximum value. Which is good, because this will 
-	# be the column I need first.
-	index = np.argmax(summed)
+	# The column with the largest summed squares will be the column I need 
+	# first. See start_column().
+	index = start_column(summed)
 
 	# The first score for the very first iteration.
-	Z = data[:,index]
+	Z = np.asarray(data[:,index], dtype = np.float64)
 	# Later I have to divide by np.dot(Z.T, Z). This however does not 
 	# work with NaN's.
 	# Since Z is a vector I can also use the sum of the squared elements.
@@ -142,46 +741,132 @@ def get_first_score(data):
 
 
 
+# The column with the largest summed squares. Standardized columns (with the
+# same number of missing values) all have the same summed squares, and then
+# rounding would decide which one is the largest. Thus the first column 
+# within 1e-6 (relative) of the largest is taken, which is the same no matter
+# how the sums were added up (e.g. by the workers of distributed_nipals.py) 
+# or if the data is np.float32.
+# Which column NIPALS starts with just decides how many iterations are 
+# needed and the sign of the component.
+def start_column(summed):
+	summed = np.asarray(summed)
+	return np.flatnonzero(summed >= (1 - 1e-6) * np.max(summed))[0]
+
+
+
+# This is the start for nipals_iteration() if a guess for the loading is 
+# known (e.g. from an earlier fit). It is the score that belongs to this 
+# loading.
+def score_from_loading(data, P, workspace = None):
+	if workspace is None:
+		observed, filled_data = get_observed_and_filled(data)
+		Z = calculate_Z_vectorized(filled_data, observed, P)
+	else:
+		Z = calculate_Z_blocked(data, workspace, P)
+
+	return Z, np.sum(Z**2)
+
+
+
 # This is the actual NIPALS iteration.
-def nipals_iteration(data, Z, length_Z):
+# 
+# The iteration stops when the score vector doesn't change anymore. With 
+# relative = True (default) this means that the length of the change of the 
+# score vector, compared to the length of the score vector, is smaller than 
+# tolerance (1e-8 if not given). This works the same way for data with large 
+# and with small numbers.
+# relative = False is the original criterion: the summed squares of the score
+# vector change by less than tolerance (1e-9 if not given).
+# 
+# acceleration = 'aitken' extrapolates the score vector every third 
+# iteration from the last two changes (the vector version of Aitken's 
+# delta-squared method by Irons and Tuck). If the scores converge slowly but 
+# steadily this cuts the number of iterations by a lot.
+# 
+# If a workspace is given (see make_workspace()), data is the zero-filled 
+# data of nipals_pca(..., in_place = True) and everything is done in blocks.
+# 
+# show_plots = False just prints the warning after 300 iterations, see below.
+# 
+# A workspace from parallel_nipals.make_parallel_workspace() means that 
+# the iteration is done by parallel_iteration().
+def nipals_iteration(data, Z, length_Z, engine = 'vectorized', \
+						tolerance = None, relative = True, acceleration = None, \
+						workspace = None, show_plots = True):
+	if tolerance is None:
+		if relative:
+			tolerance = 1e-8
+		else:
+			tolerance = 1e-9
+
+	if workspace is not None and 'pool' in workspace:
+		return parallel_iteration(data, Z, length_Z, tolerance, relative, \
+									acceleration, workspace, show_plots)
+
 	# The difference in scores between iterations.
 	# if this is sufficiently small, the next iteration will start.
 	difference = 1
 	iteration = 0
 
-	# This is an arbitrary value. It can be larger to speed up the process
-	# but this will lead to the loss of accuracy.
-	while difference > 0.000000001:
+	# The last two score vectors calculated, for the acceleration.
+	previous_Zs = []
+
+	# The vectorized engine needs to know where the data is missing. This 
+	# does not change during the iteration, so it is done just once.
+	if workspace is not None:
+		engine = 'blocked'
+	elif engine == 'vectorized':
+		observed, filled_data = get_observed_and_filled(data)
+
+	while difference > tolerance:
 		iteration += 1
 
-		# Calculate the elements of the first loading vector approximation.
-		p_s_per_column = calculate_p_s_per_column(data, Z, length_Z)
-		# Now make the correct load line vector out of the many p's 
-		# calculated above.
-		P = np.array(p_s_per_column)
-		# ATTENTION: P gets normalized in calculate_p_s_per_column
+		if engine == 'blocked':
+			P = calculate_P_blocked(data, workspace, Z)
+		elif engine == 'vectorized':
+			P = calculate_P_vectorized(filled_data, observed, Z)
+		else:
+			# Calculate the elements of the first loading vector approximation.
+			p_s_per_column = calculate_p_s_per_column(data, Z, length_Z)
+			# Now make the correct load line vector out of the many p's 
+			# calculated above.
+			P = np.array(p_s_per_column)
+
+		# ATTENTION: P is normalized to length one. Otherwise its length 
+		# (and hence the one of Z) would depend on where the iteration 
+		# started. This way all engines (and exact_components()) give the 
+		# same P and Z, and length_Z is the eigenvalue.
+		P = normalize(P)
 
 		# Now the same for the next (new) score vector.
-		z_s_per_row = calculate_z_s_per_row(data, P)
-		new_Z = np.array(z_s_per_row)
+		if engine == 'blocked':
+			new_Z = calculate_Z_blocked(data, workspace, P)
+		elif engine == 'vectorized':
+			new_Z = calculate_Z_vectorized(filled_data, observed, P)
+		else:
+			z_s_per_row = calculate_z_s_per_row(data, P)
+			new_Z = np.array(z_s_per_row)
+
 		length_new_Z = np.nansum(new_Z**2)
 
-		difference = abs(length_Z - length_new_Z)
+		if relative:
+			# The very first Z is a column of data and may contain NaN's.
+			difference = sqrt(np.nansum((new_Z - Z)**2) / length_new_Z)
+		else:
+			difference = abs(length_Z - length_new_Z)
 
-		# Why is this here?
-		# Well, I've seen in the missing value case, that some few 
-		# datapoints in the score-vector have extreme values compared to most
-		# of the data. This leads to a logarithmically slow converging 
-		# algorithm. Leaving out these few points solved the issue.
-		# Since I don't want to plot all of these manually I take care
-		# of it by automatically showing the Scores when NIPALS 
-		# needs more then 299 iterations.
 		if iteration == 300:
-			print "\n 300 iterations have passed, please check the "
-			print "data for extreme outliers. And take these out if "
-			print "after 300 more iteration NIPALs still doesn't converge."
-			pl.plot_scores(1, [1,1], 'foo', range(1, (len(Z) + 1)), [Z])
+			warn_about_iterations(Z, show_plots)
 
+		# ATTENTION: This is not done if the iteration has converged, 
+		# since then Z has to be exactly the one calculated from P.
+		if acceleration == 'aitken' and difference > tolerance:
+			previous_Zs.append(new_Z)
+			if len(previous_Zs) == 3:
+				new_Z = aitken_extrapolation(previous_Zs)
+				length_new_Z = np.sum(new_Z**2)
+				previous_Zs = []
 
 		# The new_Z is the Z to start with in the next iteration.
 		Z = new_Z
@@ -193,8 +878,13 @@ def nipals_iteration(data, Z, length_Z):
 			break
 
 	# Once the Z's and P's are know, calculate the correlation loading r.
-	r_s_per_column = calculate_r_s_per_column(data, Z, P)
-	r = np.array(r_s_per_column)
+	if engine == 'blocked':
+		r = calculate_r_blocked(data, workspace, Z)
+	elif engine == 'vectorized':
+		r = calculate_r_vectorized(filled_data, observed, Z)
+	else:
+		r_s_per_column = calculate_r_s_per_column(data, Z, P)
+		r = np.array(r_s_per_column)
 
 	# Once the correct load- and score vector for a component is found,
 	# build a correct numpy array which can then be appended to the
@@ -209,7 +899,117 @@ def nipals_iteration(data, Z, length_Z):
 
 	print "So many iterations undertaken:", iteration
 
-	return Z, P, r, length_Z
+	return Z, P, r, length_Z, iteration
+
+
+
+# Why is this here?
+# Well, I've seen in the missing value case, that some few 
+# datapoints in the score-vector have extreme values compared to most
+# of the data. This leads to a logarithmically slow converging 
+# algorithm. Leaving out these few points solved the issue.
+# Since I don't want to plot all of these manually I take care
+# of it by automatically showing the Scores when NIPALS 
+# needs more then 299 iterations.
+def warn_about_iterations(Z, show_plots = True):
+	print "\n 300 iterations have passed, please check the "
+	print "data for extreme outliers. And take these out if "
+	print "after 300 more iteration NIPALs still doesn't converge."
+	if show_plots:
+		pl.plot_scores(1, [1,1], 'foo', range(1, (len(Z) + 1)), [Z])
+
+
+
+# The same as nipals_iteration(), but the sums are calculated by the 
+# processes of parallel_nipals. The score vector is kept in shared memory.
+# Each iteration calculates the new score from P and, in the same go, the 
+# next P from this score. Thus the processes are asked just once per 
+# iteration.
+def parallel_iteration(data, Z, length_Z, tolerance, relative, acceleration, \
+													workspace, show_plots):
+	shared_Z = workspace['Z']
+	# The very first Z is a column of data and may contain NaN's.
+	np.copyto(shared_Z, np.where(np.isnan(Z), 0.0, Z))
+	next_P = pn.parallel_P(workspace)
+
+	difference = 1
+	iteration = 0
+	previous_Zs = []
+
+	while difference > tolerance:
+		iteration += 1
+
+		P = normalize(next_P)
+		next_P, change, length_new_Z = pn.parallel_step(workspace, P)
+
+		if relative:
+			difference = sqrt(change / length_new_Z)
+		else:
+			difference = abs(length_Z - length_new_Z)
+
+		if iteration == 300:
+			warn_about_iterations(shared_Z, show_plots)
+
+		# See nipals_iteration(). The extrapolated Z needs a new P.
+		if acceleration == 'aitken' and difference > tolerance:
+			previous_Zs.append(shared_Z.copy())
+			if len(previous_Zs) == 3:
+				np.copyto(shared_Z, aitken_extrapolation(previous_Zs))
+				length_new_Z = np.sum(shared_Z**2)
+				next_P = pn.parallel_P(workspace)
+				previous_Zs = []
+
+		length_Z = length_new_Z
+
+		if iteration > 600:
+			break
+
+	Z = shared_Z.copy()
+	r = calculate_r_blocked(data, workspace, Z)
+
+	print "So many iterations undertaken:", iteration
+
+	return np.array([Z]), np.array([P]), np.array([r]), length_Z, iteration
+
+
+
+# P divided by its length.
+def normalize(P):
+	return P / sqrt(np.sum(P**2))
+
+
+
+# Just to keep nipals_iteration() a bit more tidy.
+# If the scores converge linearly, each change is (almost) the change before
+# times a factor rho. Then the limit can be guessed from three score vectors. 
+# If the changes don't look like this (rho not between 0 and 1, here with 
+# some safety margin) nothing is extrapolated.
+def aitken_extrapolation(previous_Zs):
+	first_difference = previous_Zs[1] - previous_Zs[0]
+	second_difference = previous_Zs[2] - previous_Zs[1]
+	change = second_difference - first_difference
+
+	factor = aitken_factor(np.dot(change, change), \
+										np.dot(second_difference, change))
+	if factor is None:
+		return previous_Zs[2]
+
+	return previous_Zs[2] - factor * second_difference
+
+
+
+# The factor of aitken_extrapolation(), from the two sums. None means that
+# nothing is extrapolated.
+def aitken_factor(squared_change, product):
+	if squared_change == 0:
+		return None
+
+	# For linear convergence factor is rho/(rho - 1).
+	factor = product / squared_change
+	if not -100 < factor < 0:
+		return None
+
+	return factor
 
 
 
@@ -239,16 +1039,18 @@ def calculate_r_s_per_column(data, Z, P):
 		# consistency reasons.
 		z_dash = np.nansum(modified_Z) / len(modified_Z)
 
+		# ATTENTION: modified_Z has fewer elements than data[:,o]. Hence, the 
+		# i-th element of modified_Z belongs to the i-th OBSERVED element of
+		# data[:,o] and not to data[:,o][i].
+		observed_data = data[:,o][~np.isnan(data[:,o])]
+
 		for i in range(len(modified_Z)):
-			if np.isnan(data[:,o][i]):
-				pass
-			else:
-				first_factor = data[:,o][i] - x_dash
-				second_factor = modified_Z[i] - z_dash
+			first_factor = observed_data[i] - x_dash
+			second_factor = modified_Z[i] - z_dash
 
-				upper_sum += first_factor * second_factor
-				first_lower_sum += first_factor**2
-				second_lower_sum += second_factor**2
+			upper_sum += first_factor * second_factor
+			first_lower_sum += first_factor**2
+			second_lower_sum += second_factor**2
 
 		divisor = sqrt(first_lower_sum) * sqrt(second_lower_sum)
 
@@ -344,56 +1146,318 @@ def calculate_z_s_per_row(data, P):
 
 
 
+# The vectorized engine works on a copy of the data in which all missing 
+# values are set to zero. Together with the mask of the observed values all 
+# sums of calculate_p_s_per_column() and calculate_z_s_per_row() become 
+# matrix multiplications: the zeros don't contribute to the upper sums and 
+# the mask makes sure that the lower sums don't contain the elements 
+# where the data is missing.
+# The mask is stored as 1.0/0.0 instead of True/False, otherwise numpy would 
+# have to convert it for each matrix multiplication again.
+def get_observed_and_filled(data):
+	observed = ~np.isnan(data)
+	filled_data = np.where(observed, data, 0.0)
+	observed = observed.astype(filled_data.dtype)
+
+	return observed, filled_data
+
+
+
+# Does the same as calculate_p_s_per_column(), just with whole arrays.
+def calculate_P_vectorized(filled_data, observed, Z):
+	# Since the first Z is just a column from data it may contain NaN's.
+	# These must neither be in the upper nor in the lower sum, which is 
+	# the same as if they were zero.
+	filled_Z = np.where(np.isnan(Z), 0.0, Z)
+
+	upper_sum = np.dot(filled_data.T, filled_Z)
+	lower_sum = np.dot(observed.T, filled_Z**2)
+
+	return upper_sum / lower_sum
+
+
+
+# Does the same as calculate_z_s_per_row(), just with whole arrays.
+def calculate_Z_vectorized(filled_data, observed, P):
+	upper_sum = np.dot(filled_data, P)
+	lower_sum = np.dot(observed, P**2)
+
+	return upper_sum / lower_sum
+
+
+
+# Does the same as calculate_r_s_per_column(), but for all columns at once.
+# Each column is correlated with Z just where the column was observed 
+# ("pairwise complete"). Instead of removing the elements from Z, the sums 
+# are taken with the mask, so that nothing needs to be copied per column.
+# If observed is None, no value is missing.
+def calculate_r_vectorized(filled_data, observed, Z):
+	if observed is None:
+		so_many_observed = filled_data.shape[0]
+		z_dash = np.mean(Z)
+		observed_Z_squared = np.sum(Z**2)
+	else:
+		so_many_observed = observed.sum(axis=0)
+		z_dash = np.dot(observed.T, Z) / so_many_observed
+		observed_Z_squared = np.dot(observed.T, Z**2)
+
+	x_dash = filled_data.sum(axis=0) / so_many_observed
+
+	# The data minus the column-mean where the data was observed and zero 
+	# otherwise. This is the only array that has the size of data.
+	first_factors = filled_data - x_dash
+	if observed is not None:
+		first_factors *= observed
+
+	# Since the first factors of each column sum up to zero, z_dash falls
+	# out of the upper sum.
+	upper_sum = np.dot(first_factors.T, Z)
+	first_lower_sum = np.sum(first_factors**2, axis=0)
+	# sum((Z - z_dash)**2) over the observed elements, written such that no 
+	# array with the size of data is needed.
+	second_lower_sum = observed_Z_squared - so_many_observed * z_dash**2
+
+	divisor = np.sqrt(first_lower_sum) * np.sqrt(second_lower_sum)
+
+	return upper_sum / divisor
+
+
+
+# For nipals_pca(..., in_place = True) everything that is needed to work 
+# on data without copying it.
+# The missing values in data are set to zero (and the NaN's put back in 
+# the end). Then data is the same as filled_data of the vectorized engine.
+# Just the mask of the observed values is needed, but as True/False which 
+# needs just 1/8 of the memory of data. 
+# Everything is done in blocks of block_size rows. For each block the mask 
+# is converted to 1.0/0.0 into the same buffer and a second buffer is used 
+# for everything else that has the size of a block.
+# 
+# With keep_nans = True data is not changed and no mask is stored. Instead, 
+# the mask and the zero-filled block are made from the NaN's of each block, 
+# in a third buffer. This is for data on the disk (see nipals_pca(..., 
+# scratch_file = ...)), of which even the mask would be too large.
+# 
+# The buffers are always np.float64. If data is not (e.g. np.float32), each 
+# block is copied into the third buffer, too, so that all sums are 
+# calculated as np.float64.
+def make_workspace(data, block_size = None, keep_nans = False):
+	if block_size is None:
+		block_size = default_block_size(data)
+
+	if keep_nans:
+		observed = None
+	else:
+		observed = ~np.isnan(data)
+		np.copyto(data, 0, where = ~observed)
+
+	block_shape = (min(block_size, data.shape[0]), data.shape[1])
+	workspace = {'observed': observed, 'block_size': block_size, \
+				'mask_buffer': np.empty(block_shape, dtype = np.float64), \
+				'buffer': np.empty(block_shape, dtype = np.float64)}
+	if keep_nans or data.dtype != np.float64:
+		workspace['filled_buffer'] = np.empty(block_shape, dtype = np.float64)
+
+	return workspace
+
+
+
+# Just to keep the blocked functions below a bit more tidy.
+# Yields for each block of rows the slice, the block with zeros instead of 
+# NaN's and the mask as 1.0/0.0.
+def blocks_with_mask(data, workspace):
+	number_of_rows = data.shape[0]
+	block_size = workspace['block_size']
+	for start in range(0, number_of_rows, block_size):
+		rows = slice(start, min(start + block_size, number_of_rows))
+		mask = workspace['mask_buffer'][:rows.stop - rows.start]
+
+		if workspace['observed'] is None:
+			block = data[rows]
+			missing = np.isnan(block)
+			np.copyto(mask, ~missing)
+
+			filled_block = workspace['filled_buffer'][:rows.stop - rows.start]
+			np.copyto(filled_block, block)
+			np.copyto(filled_block, 0, where = missing)
+		else:
+			np.copyto(mask, workspace['observed'][rows])
+			filled_block = data[rows]
+			if filled_block.dtype != mask.dtype:
+				filled_block = workspace['filled_buffer'][:rows.stop - rows.start]
+				np.copyto(filled_block, data[rows])
+
+		yield rows, filled_block, mask
+
+
+
+# Does the same as calculate_P_vectorized(), block by block.
+def calculate_P_blocked(data, workspace, Z):
+	filled_Z = np.where(np.isnan(Z), 0.0, Z)
+
+	upper_sum = np.zeros(data.shape[1])
+	lower_sum = np.zeros(data.shape[1])
+	for rows, filled_block, mask in blocks_with_mask(data, workspace):
+		upper_sum += np.dot(filled_block.T, filled_Z[rows])
+		lower_sum += np.dot(mask.T, filled_Z[rows]**2)
+
+	return upper_sum / lower_sum
+
+
+
+# Does the same as calculate_Z_vectorized(), block by block.
+def calculate_Z_blocked(data, workspace, P):
+	Z = np.empty(data.shape[0])
+	squared_P = P**2
+	for rows, filled_block, mask in blocks_with_mask(data, workspace):
+		Z[rows] = np.dot(filled_block, P) / np.dot(mask, squared_P)
+
+	return Z
+
+
+
+# Does the same as calculate_r_vectorized(), block by block.
+def calculate_r_blocked(data, workspace, Z):
+	so_many_observed = np.zeros(data.shape[1])
+	column_sums = np.zeros(data.shape[1])
+	observed_Z = np.zeros(data.shape[1])
+	observed_Z_squared = np.zeros(data.shape[1])
+	for rows, filled_block, mask in blocks_with_mask(data, workspace):
+		so_many_observed += mask.sum(axis=0)
+		column_sums += filled_block.sum(axis=0)
+		observed_Z += np.dot(mask.T, Z[rows])
+		observed_Z_squared += np.dot(mask.T, Z[rows]**2)
+
+	x_dash = column_sums / so_many_observed
+	z_dash = observed_Z / so_many_observed
+
+	upper_sum = np.zeros(data.shape[1])
+	first_lower_sum = np.zeros(data.shape[1])
+	for rows, filled_block, mask in blocks_with_mask(data, workspace):
+		first_factors = workspace['buffer'][:rows.stop - rows.start]
+		np.subtract(filled_block, x_dash, out = first_factors)
+		first_factors *= mask
+
+		upper_sum += np.dot(first_factors.T, Z[rows])
+		first_lower_sum += np.sum(first_factors**2, axis=0)
+
+	second_lower_sum = observed_Z_squared - so_many_observed * z_dash**2
+
+	return upper_sum / (np.sqrt(first_lower_sum) * np.sqrt(second_lower_sum))
+
+
+
+# data = data - Z^T*P, without creating another array of the size of data.
+# 
+# Returned is how much the summed squares of each row and column change.
+# For the observed elements e of a row that is 
+# sum((e - z*p)**2) - sum(e**2) = z**2*sum(p**2) - 2*z*sum(e*p)
+# and the same for the columns. The sums are calculated from the block 
+# anyway, just before it is changed.
+# 
+# Just the observed elements are changed. If data is zero-filled (see 
+# make_workspace()), the others must stay zero. NaN's stay NaN's anyway.
+# With a workspace of parallel_nipals this is done by its processes.
+def deflate(data, Z, P, workspace = None, block_size = None):
+	if workspace is None:
+		workspace = make_workspace(data, block_size, keep_nans = True)
+	elif 'pool' in workspace:
+		np.copyto(workspace['Z'], Z)
+		return pn.parallel_deflate(workspace, P)
+
+	row_changes = np.zeros(data.shape[0])
+	column_changes = np.zeros(data.shape[1])
+	squared_P = P**2
+	for rows, filled_block, mask in blocks_with_mask(data, workspace):
+		row_changes[rows] = Z[rows]**2 * np.dot(mask, squared_P) - \
+								2 * Z[rows] * np.dot(filled_block, P)
+		column_changes += squared_P * np.dot(mask.T, Z[rows]**2) - \
+								2 * P * np.dot(filled_block.T, Z[rows])
+
+		product = workspace['buffer'][:rows.stop - rows.start]
+		np.multiply(Z[rows, np.newaxis], P, out = product)
+		product *= mask
+		data[rows] -= product
+
+	return row_changes, column_changes
+
+
+
+# For nipals_pca(..., scratch_file = ...). The residual is calculated in a 
+# copy of data on the disk (a .npy file that is memory mapped). data itself
+# can be memory mapped, too, and is copied block by block.
+# np.float32 data stays np.float32.
+def copy_to_scratch(data, scratch_file, block_size = None):
+	if block_size is None:
+		block_size = default_block_size(data)
+
+	if data.dtype == np.float32:
+		dtype = np.float32
+	else:
+		dtype = np.float64
+
+	scratch = np.lib.format.open_memmap(scratch_file, mode = 'w+', \
+								dtype = dtype, shape = data.shape)
+	for start in range(0, data.shape[0], block_size):
+		scratch[start:start + block_size] = data[start:start + block_size]
+
+	return scratch
+
+
+
+# If there is any NaN in data, checked block by block.
+def any_missing(data, block_size = None):
+	if block_size is None:
+		block_size = default_block_size(data)
+
+	for start in range(0, data.shape[0], block_size):
+		if np.isnan(data[start:start + block_size]).any():
+			return True
+
+	return False
+
+
+
 # Now the R_2 variance for the original data minus the data constructed
 # from the Score and load vector that were calculated above. 
 # Since the Subtraction was taken care of before, I just need to use data.
+# ATTENTION: nipals_pca() doesn't use this and the next two functions any 
+# longer but updates the summed squares with each component (see deflate()).
+# They are still useful to calculate the same things for any residual.
 def calculate_R_2(data, variance_rawdata):
-	variance_new_data = np.nansum(data*data)
+	row_sums, column_sums = sums_of_squares(data)
 	
-	return 1 - variance_new_data/variance_rawdata
+	return 1 - np.sum(column_sums)/variance_rawdata
 
 
 
 # Dito for the variance per column.
 def calculate_R_k_2(data, column_variance_rawdata):
-	new_R_k_2 = []
-	for i in range(data.shape[1]):
-		column_variance_new_data = np.nansum(data[:,i]*data[:,i])
-		new_R_k_2.append(1 - column_variance_new_data/column_variance_rawdata[i])
+	row_sums, column_sums = sums_of_squares(data)
 
-	return new_R_k_2
+	return 1 - column_sums/np.asarray(column_variance_rawdata)
 
 
 
-# Now the square prediction error per variable.
+# Now the square prediction error per observation.
 def calculate_SPE(data):
-	new_SPE = []
-	for i in range(data.shape[0]):
-		foo = sqrt(np.dot(data[i].reshape(data[0].shape[0], 1).T, \
-									data[i].reshape(data[0].shape[0], 1)))
-		if np.isnan(foo):
-			foo = sqrt(np.nansum(data[i]**2))
+	row_sums, column_sums = sums_of_squares(data)
 
-		new_SPE.append(foo)
-
-	return new_SPE
+	return np.sqrt(row_sums)
 
 
 
 # And finally Hotelling's T^2.
+# T_2 are the T^2's of the components before, the new one is added to the 
+# last of these.
 def calculate_T_2(Z, T_2):
-	new_T_2 = []
+	s_a = np.std(Z)
+	new_T_2 = (Z[0]/s_a)**2
+
 	if len(T_2) == 0:
-		s_a = np.std(Z)
-		for i in range(Z.shape[1]):
-			new_T_2.append((Z[0][i]/s_a)**2)
+		return new_T_2
 	else:
-		add_to_this = len(T_2) - 1
-		s_a = np.std(Z)
-		for i in range(Z.shape[1]):
-			new_T_2.append(T_2[add_to_this][i] + (Z[0][i]/s_a)**2)
-
-	return new_T_2
+		return T_2[-1] + new_T_2
 
 
 
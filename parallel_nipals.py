@@ -0,0 +1,211 @@
+#    "PCA" (v0.7)
+#    Copyright 2016 Soren Heinze
+#    soerenheinze@gmx.de
+#    5B1C 1897 560A EF50 F1EB 2579 2297 FAE4 D9B5 2A35
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# This is for nipals_pca(..., engine = 'parallel'): The sums of the NIPALS
+# iteration are calculated by several processes at the same time.
+#
+# The (zero-filled) data, the mask of the observed values and the score
+# vector are stored in shared memory. The processes of the pool are started
+# (forked) after that, thus they see the same memory and nothing of the size
+# of the data is ever sent to them. The rows are split into as many parts as
+# there are processes. Each process calculates for its rows
+# - the new score (Z = X*P / M*P^2, for these rows alone),
+# - how much the score changed and
+# - the sums for the next loading (X^T*Z and M^T*Z^2).
+# These sums are all that is sent back, and they are just added up.
+# So each iteration needs just one round trip of the pool, in which just two
+# vectors with one value per variable are sent and received per process.
+#
+# ATTENTION: This works just where processes are forked (Linux, Mac), not
+# under Windows.
+
+import numpy as np
+from multiprocessing import Pool, RawArray, cpu_count
+
+# What the processes need. This is set before the pool is started, thus each
+# process has its own reference to the same shared memory.
+shared = {}
+
+# Puts data (zero-filled) and its mask into shared memory and starts
+# workers processes (default: as many as there are cores).
+# Returned is a workspace (see nipals_algorithm.make_workspace(), the keys
+# of which are all there, too) and the zero-filled data in shared memory,
+# which is used as the residual.
+# As for make_workspace() the mask is stored as True/False, which needs 
+# just 1/8 of the memory of data. The processes convert it to 1.0/0.0 block
+# by block.
+def make_parallel_workspace(data, workers = None, block_size = None):
+	if workers is None:
+		workers = cpu_count()
+	if block_size is None:
+		block_size = max(1, 2**20 // max(1, data.shape[1]))
+
+	number_of_rows, number_of_columns = data.shape
+	filled_data = shared_array((number_of_rows, number_of_columns))
+	observed = shared_array((number_of_rows, number_of_columns), np.bool_)
+
+	# Block by block, data can be memory mapped.
+	for start in range(0, number_of_rows, block_size):
+		block = data[start:start + block_size]
+		missing = np.isnan(block)
+		observed[start:start + block_size] = ~missing
+		filled_data[start:start + block_size] = block
+		filled_data[start:start + block_size][missing] = 0
+
+	shared.clear()
+	shared['data'] = filled_data
+	shared['observed'] = observed
+	shared['Z'] = shared_array(number_of_rows)
+	shared['row_changes'] = shared_array(number_of_rows)
+	shared['block_size'] = block_size
+
+	borders = np.linspace(0, number_of_rows, workers + 1).astype(int)
+	parts = [(borders[i], borders[i + 1]) for i in range(workers) \
+												if borders[i + 1] > borders[i]]
+
+	block_shape = (min(block_size, number_of_rows), number_of_columns)
+	workspace = {'observed': observed, 'block_size': block_size, \
+				'mask_buffer': np.empty(block_shape), \
+				'buffer': np.empty(block_shape), \
+				'Z': shared['Z'], 'row_changes': shared['row_changes'], \
+				'parts': parts, 'pool': Pool(len(parts))}
+
+	return workspace, filled_data
+
+
+
+# An array in shared memory.
+def shared_array(shape, dtype = np.float64):
+	size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+	return np.frombuffer(RawArray('b', size), dtype = dtype).reshape(shape)
+
+
+
+# The pool is not needed any longer. terminate() instead of close(), since
+# this is also called if something went wrong (e.g. Ctrl-C) while the 
+# processes still work.
+# The shared memory is not needed either (the residual is still there if 
+# the caller has it).
+def close_parallel_workspace(workspace):
+	workspace['pool'].terminate()
+	workspace['pool'].join()
+	shared.clear()
+
+
+
+# The loading calculated from the score that is already in shared memory
+# (see nipals_algorithm.calculate_P_vectorized()).
+def parallel_P(workspace):
+	results = workspace['pool'].map(partial_P, workspace['parts'])
+	upper_sum = sum(result[0] for result in results)
+	lower_sum = sum(result[1] for result in results)
+
+	return upper_sum / lower_sum
+
+
+
+# One iteration: new scores from P (these are then in shared memory) and the
+# next loading. Returned are the next loading, the summed squared changes of
+# the scores and the summed squares of the new scores.
+def parallel_step(workspace, P):
+	tasks = [(start, stop, P) for start, stop in workspace['parts']]
+	results = workspace['pool'].map(fused_step, tasks)
+
+	upper_sum = sum(result[0] for result in results)
+	lower_sum = sum(result[1] for result in results)
+	change = sum(result[2] for result in results)
+	length_Z = sum(result[3] for result in results)
+
+	return upper_sum / lower_sum, change, length_Z
+
+
+
+# data = data - Z^T*P (see nipals_algorithm.deflate()), each process for its
+# rows. Z needs to be in shared memory already.
+def parallel_deflate(workspace, P):
+	tasks = [(start, stop, P) for start, stop in workspace['parts']]
+	results = workspace['pool'].map(partial_deflate, tasks)
+
+	return workspace['row_changes'].copy(), sum(results)
+
+
+
+# What the processes do. They need to be functions of the module, otherwise
+# they can't be sent to the processes.
+# Each process goes through its rows in blocks. Yielded are the rows, the 
+# data and the mask as 1.0/0.0 of each block.
+def part_blocks(start, stop):
+	for block_start in range(start, stop, shared['block_size']):
+		rows = slice(block_start, min(block_start + shared['block_size'], stop))
+		yield rows, shared['data'][rows], \
+								shared['observed'][rows].astype(np.float64)
+
+
+
+def partial_P(part):
+	start, stop = part
+	number_of_columns = shared['data'].shape[1]
+
+	upper_sum = np.zeros(number_of_columns)
+	lower_sum = np.zeros(number_of_columns)
+	for rows, X, M in part_blocks(start, stop):
+		Z = shared['Z'][rows]
+		upper_sum += np.dot(X.T, Z)
+		lower_sum += np.dot(M.T, Z**2)
+
+	return upper_sum, lower_sum
+
+
+
+def fused_step(task):
+	start, stop, P = task
+	number_of_columns = shared['data'].shape[1]
+
+	upper_sum = np.zeros(number_of_columns)
+	lower_sum = np.zeros(number_of_columns)
+	change = 0.0
+	length_Z = 0.0
+	squared_P = P**2
+	for rows, X, M in part_blocks(start, stop):
+		new_Z = np.dot(X, P) / np.dot(M, squared_P)
+		change += np.sum((new_Z - shared['Z'][rows])**2)
+		shared['Z'][rows] = new_Z
+
+		upper_sum += np.dot(X.T, new_Z)
+		lower_sum += np.dot(M.T, new_Z**2)
+		length_Z += np.sum(new_Z**2)
+
+	return upper_sum, lower_sum, change, length_Z
+
+
+
+def partial_deflate(task):
+	start, stop, P = task
+
+	column_changes = np.zeros(shared['data'].shape[1])
+	squared_P = P**2
+	for rows, X, M in part_blocks(start, stop):
+		Z = shared['Z'][rows]
+		shared['row_changes'][rows] = Z**2 * np.dot(M, squared_P) - \
+													2 * Z * np.dot(X, P)
+		column_changes += squared_P * np.dot(M.T, Z**2) - \
+													2 * P * np.dot(X.T, Z)
+
+		X -= np.outer(Z, P) * M
+
+	return column_changes
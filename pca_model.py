@@ -0,0 +1,159 @@
+#    "PCA" (v0.7)
+#    Copyright 2016 Soren Heinze
+#    soerenheinze@gmx.de
+#    5B1C 1897 560A EF50 F1EB 2579 2297 FAE4 D9B5 2A35
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Once the components are found, new observations can be compared with them
+# without fitting everything again. A "model" is a dictionary with everything
+# that is needed for this: the loadings, the preprocessing (see
+# data_preprocessing.get_transform()) and how large the scores of each
+# component usually are (for Hotelling's T^2).
+#
+# transform = dp.get_transform(these_processes, enhance_these, data)
+# dp.apply_transform(transform, data)
+# Z_merged, P_merged, ... = na.nipals_pca(data, ...)
+# model = build_model(Z_merged, P_merged, transform, variables)
+# save_model('foo_model.npz', model)
+# ...
+# model = load_model('foo_model.npz')
+# Z_new, SPE_new, T_2_new = project(model, new_data)
+#
+# With control limits (see add_control_limits()) it is also known which of
+# the new observations are unusual.
+
+import numpy as np
+from scipy import stats
+import nipals_algorithm as na
+import data_preprocessing as dp
+
+# Z_merged and P_merged are what nipals_pca() returned, transform what the
+# data was preprocessed with (nothing, if not given). variables are just
+# stored, to know later what each column is.
+#
+# 'score_std' is the same standard deviation of each score vector that
+# nipals_algorithm.calculate_T_2() uses, hence the T^2 of new observations
+# are comparable to the ones of the data. 'reference_variances' are the
+# summed squares of each column of the preprocessed data (see
+# data_preprocessing.reference_variances()), if known.
+def build_model(Z_merged, P_merged, transform = None, variables = None):
+	number_of_columns = P_merged.shape[1]
+
+	if transform is None:
+		transform = {'mean': np.zeros(number_of_columns), \
+					'scale': np.ones(number_of_columns), \
+					'boost': np.ones(number_of_columns)}
+
+	model = {'loadings': np.array(P_merged, dtype = np.float64), \
+			'score_std': np.std(Z_merged, axis=1), \
+			'eigenvalues': np.sum(Z_merged**2, axis=1), \
+			'number_of_observations': Z_merged.shape[1], \
+			'mean': np.array(transform['mean'], dtype = np.float64), \
+			'scale': np.array(transform['scale'], dtype = np.float64), \
+			'boost': np.array(transform['boost'], dtype = np.float64)}
+
+	if 'centered_sums' in transform:
+		variance, column_variances = dp.reference_variances(transform)
+		model['reference_variances'] = column_variances
+
+	if variables is not None:
+		model['variables'] = list(variables)
+
+	return model
+
+
+
+# Adds to model (in place) the limits above which the T^2 and SPE of an 
+# observation are unusual (with the probability confidence they are below).
+# As T_2 and SPE of nipals_pca(), line i is for the first i + 1 components.
+# 
+# The T^2 limit assumes the scores to be normally distributed. Then T^2 of
+# a new observation follows an F-distribution: 
+# a*(n - 1)*(n + 1)/(n*(n - a)) * F(a, n - a) for a components and n 
+# observations the model was fitted with.
+# For the SPE no such assumption is made. The limit is simply the percentile
+# of the SPE of the observations the model was fitted with (what 
+# nipals_pca() returned), thus SPE is needed here.
+def add_control_limits(model, SPE, confidence = 0.99):
+	number_of_components = model['loadings'].shape[0]
+	n = model['number_of_observations']
+
+	a = np.arange(1, number_of_components + 1)
+	model['T_2_limit'] = a * (n - 1.0) * (n + 1.0) / (n * (n - a)) * \
+									stats.f.ppf(confidence, a, n - a)
+	model['SPE_limit'] = np.percentile(SPE, 100 * confidence, axis=1)
+
+	return model
+
+
+
+# Saves the model as a .npz file. The variables can be numbers or text,
+# hence they are stored as text.
+def save_model(outfile, model):
+	to_save = {}
+	for key, value in model.items():
+		if key == 'variables':
+			to_save[key] = np.array([str(variable) for variable in value])
+		else:
+			to_save[key] = np.asarray(value)
+
+	np.savez(outfile, **to_save)
+
+
+
+# The model saved with save_model().
+def load_model(infile):
+	model = {}
+	with np.load(infile) as stored:
+		for key in stored.files:
+			model[key] = stored[key]
+
+	if 'variables' in model:
+		model['variables'] = model['variables'].tolist()
+	if 'number_of_observations' in model:
+		model['number_of_observations'] = float(model['number_of_observations'])
+
+	return model
+
+
+
+# The scores, the SPE and Hotelling's T^2 of new observations (one per row of
+# new_data, with the same columns as the data of the model and NOT
+# preprocessed). These are arranged the same way as what nipals_pca()
+# returns: line i belongs to component i + 1, and SPE and T^2 in line i are
+# for the first i + 1 components together.
+#
+# NaN's are allowed. The scores of each row are calculated from the
+# observed values of this row alone, for all components at once (see
+# nipals_algorithm.masked_least_squares()). This is done for all rows in one
+# go. Without missing values this is simply the data times the loadings.
+# The SPE is calculated from the observed values, too.
+def project(model, new_data):
+	data = np.array(new_data, dtype = np.float64, ndmin = 2)
+	dp.apply_transform(model, data)
+
+	P = model['loadings']
+	observed, filled_data = na.get_observed_and_filled(data)
+	Z = na.masked_least_squares(filled_data, observed, P)
+
+	number_of_components = P.shape[0]
+	SPE = np.zeros((number_of_components, data.shape[0]))
+	for i in range(number_of_components):
+		filled_data -= np.outer(Z[i], P[i]) * observed
+		SPE[i] = np.sqrt(np.sum(filled_data**2, axis=1))
+
+	T_2 = np.cumsum((Z / model['score_std'][:, np.newaxis])**2, axis=0)
+
+	return Z, SPE, T_2
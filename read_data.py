@@ -33,97 +33,365 @@
 # represent e.g. one experiment/sample.
 # The program asks for this and will transpose the matrix.
 # See also the comment below.
+# 
+# stream_data() reads the file block by block, for files that shall not be in
+# memory all at once.
+# 
+# With read_data(infile, cache = True) the parsed data is stored in a binary
+# file in the folder ".pca_cache" next to infile. The next time the same file
+# is read, the data comes from there (see get_cached()).
 
 import numpy as np
-from copy import deepcopy
+import warnings
+import os
+import cPickle as pickle
+import hashlib
 
 # This function is called in read_data() and written just to keep the latter
 # more orderly. f is the infile.
-def get_the_data(f):
-	variables = []
-	observations = []
-	just_the_data = []
+# 
+# The data is not converted value by value into lists but in blocks of 
+# block_size lines at once (see convert_block()) directly into an array.
+# To know how large this array has to be, the lines are counted first.
+# 
+# If transpose is True ("physics data") the array is build right away the 
+# other way around. Each block goes into its columns. Thus the array is in 
+# the order numpy likes it (each row one after another in memory), which 
+# data.T would not be. 
+# dtype is how the numbers are stored, see read_data().
+def get_the_data(f, block_size = 10000, transpose = False, dtype = np.float64):
+	# The first line contains the descriptors of the variables 
+	# (e.g. the wavelength's or attributes investigated).
+	variables = get_variables(next(f))
+	number_of_columns = len(variables) - 1
 
-	linecount = 1
+	number_of_rows = 0
 	for line in f:
-		# The first line contains the descriptors of the variables 
-		# (e.g. the wavelength's or attributes investigated).
-		# In the else-clause it will be "converted" into the variables.
-		if linecount != 1:
-			numbers = []
-			all_in_line = line.strip().split(',')
-			first_entry = all_in_line.pop(0)
-
-			# The first entry in each line contains e.g. the sample- or 
-			# measurement number; vulgo: the observations
-			try:
-				# Try to make numbers if possible.
-				observations.append(float(first_entry))
-			except ValueError:
-				# Otherwise use the given string.
-				observations.append(first_entry)
+		if line.strip() != '':
+			number_of_rows += 1
 
-			for number in all_in_line:
-				# Everything else should be just numbers
-				try:
-					numbers.append(float(number))
-				# If not, use an appropriate NaN.
-				except ValueError:
-					numbers.append(np.nan)
+	f.seek(0)
+	next(f)
 
-			just_the_data.append(numbers)
+	if transpose:
+		just_the_data = np.empty((number_of_columns, number_of_rows), \
+															dtype = dtype)
+	else:
+		just_the_data = np.empty((number_of_rows, number_of_columns), \
+															dtype = dtype)
+	observations = []
 
+	row = 0
+	for labels, block in data_blocks(f, number_of_columns, block_size):
+		observations.extend(labels)
+		if transpose:
+			just_the_data[:, row:row + len(block)] = block.T
 		else:
-			try:
-				for number in line.strip().split(','):
-					variables.append(float(number))
-			except ValueError:
-				variables = line.strip().split(',')
-
-		linecount += 1
+			just_the_data[row:row + len(block)] = block
+		row += len(block)
 
 	return variables, observations, just_the_data
 
 
-# This is the function to be called. 
-def read_data(infile):
-	with open(infile, 'r') as f:
-		variables, observations, just_the_data = get_the_data(f)
 
-	# The first entry in variables does not belong to the data but is
-	# a descriptor like e.g. "Sample" or "Measurement".
-	# Hence, it mus tbe removed
-	variables.pop(0)
+# The first line of the file.
+def get_variables(line):
+	try:
+		variables = []
+		for number in line.strip().split(','):
+			variables.append(float(number))
+	except ValueError:
+		variables = line.strip().split(',')
+
+	return variables
+
+
+
+# The first entry in each line contains e.g. the sample- or 
+# measurement number; vulgo: the observations
+def get_observation(first_entry):
+	try:
+		# Try to make numbers if possible.
+		return float(first_entry)
+	except ValueError:
+		# Otherwise use the given string.
+		return first_entry
+
+
+
+# Goes through the lines of f (after the first line) and yields the 
+# observations and the converted data of block_size lines at a time.
+# Empty lines are skipped. A line with more or fewer values than there are 
+# variables raises a ValueError.
+def data_blocks(f, number_of_columns, block_size = 10000):
+	labels = []
+	rest_of_lines = []
+	for line in f:
+		line = line.strip()
+		if line == '':
+			continue
+
+		all_in_line = line.split(',', 1)
+		if len(all_in_line) > 1:
+			rest_of_line = all_in_line[1]
+		else:
+			rest_of_line = ''
+
+		# convert_block() parses all lines of a block at once and can't see 
+		# where one line ends. Thus a line with too many or too few values 
+		# must be found here, otherwise its values would end up in the next 
+		# line.
+		if rest_of_line.count(',') != number_of_columns - 1:
+			text = "A line has %s values but there are %s variables: %s"
+			raise ValueError(text % (rest_of_line.count(',') + 1, \
+											number_of_columns, rest_of_line))
+
+		labels.append(get_observation(all_in_line[0]))
+		rest_of_lines.append(rest_of_line)
+
+		if len(labels) == block_size:
+			yield labels, convert_block(rest_of_lines, number_of_columns)
+			labels = []
+			rest_of_lines = []
+
+	if len(labels) > 0:
+		yield labels, convert_block(rest_of_lines, number_of_columns)
+
+
+
+# Converts the lines (without the first entry) into an array.
+# The fast way: All lines are joined into one long string, empty entries
+# are replaced by "nan" and numpy parses the whole string at once.
+# If that doesn't give the right number of values, something in these lines 
+# can't be converted (e.g. text). Then these lines are converted the slow 
+# way, value by value, and everything that is not a number becomes NaN.
+def convert_block(rest_of_lines, number_of_columns):
+	so_many_values = len(rest_of_lines) * number_of_columns
+
+	text = ','.join(rest_of_lines)
+	# Two times, since ',,,' becomes ',nan,,' after the first time.
+	text = text.replace(',,', ',nan,').replace(',,', ',nan,')
+	if text.startswith(','):
+		text = 'nan' + text
+	if text.endswith(','):
+		text = text + 'nan'
+
+	if so_many_values > 0:
+		# Newer numpy versions warn if not the whole string could be parsed.
+		# This is checked right below anyway.
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', DeprecationWarning)
+			block = np.fromstring(text, sep = ',')
+		if block.size == so_many_values:
+			return block.reshape(len(rest_of_lines), number_of_columns)
+
+	block = np.empty((len(rest_of_lines), number_of_columns))
+	for i, rest_of_line in enumerate(rest_of_lines):
+		all_in_line = rest_of_line.split(',')
+		if len(all_in_line) != number_of_columns:
+			text = "A line has %s values but there are %s variables: %s"
+			raise ValueError(text % (len(all_in_line), number_of_columns, \
+															rest_of_line))
+
+		for j, number in enumerate(all_in_line):
+			# Everything else should be just numbers
+			try:
+				block[i, j] = float(number)
+			# If not, use an appropriate NaN.
+			except ValueError:
+				block[i, j] = np.nan
+
+	return block
 
-	data = np.array(just_the_data)
 
+# This is the function to be called. 
+# 
+# dtype = np.float32 stores the data with half the memory. For most 
+# measured data this precision is more than enough. See nipals_pca() for 
+# what this means for the results.
+# 
+# physics = True or False says if it is "physics data" (see below). Only if 
+# it is not given the user is asked.
+def read_data(infile, cache = False, dtype = np.float64, physics = None):
 	# Usually data is available in the form of variables (e.g. wavelength's) in 
 	# horizontal direction and e.g. samples or observations in vertical
 	# direction.
 	# This program relies on that.
 	# However, in physics it's the other way around.
-	# Thus I have to switch the labels and transpose the data
-	physical_data = raw_input("Is it 'Physics data' (see manual) (1 = YES): ")
+	# Thus I have to switch the labels and transpose the data.
+	# This is asked first, since the data is read directly the right way 
+	# around (see get_the_data()).
+	if physics is None:
+		physical_data = raw_input("Is it 'Physics data' (see manual) (1 = YES): ")
+		physics = physical_data == '1'
+
+	cached = None
+	if cache:
+		cached = get_cached(infile, physics, dtype)
+
+	if cached is not None:
+		variables, observations, data = cached
+	else:
+		with open(infile, 'r') as f:
+			variables, observations, just_the_data = get_the_data(f, \
+										transpose = physics, dtype = dtype)
+
+		# The first entry in variables does not belong to the data but is
+		# a descriptor like e.g. "Sample" or "Measurement".
+		# Hence, it mus tbe removed
+		variables.pop(0)
+
+		# The labels just need to change places. The data is already 
+		# transposed.
+		if physics:
+			variables, observations = observations, variables
+
+		data = just_the_data
+
+		if cache:
+			write_cache(infile, variables, observations, data, physics, dtype)
+
+	# ATTENTION: Earlier a copy of data ("rawdata") was returned, too, since 
+	# some calculations need the variances of the preprocessed data. These
+	# are now calculated from the preprocessing itself, see 
+	# data_preprocessing.get_transform().
+
+	return data, variables, observations
+
+
+
+# For files that are too large to be read at once.
+# Returned are the variables and a generator that yields the observations 
+# and the data of block_size lines at a time, each block as an array.
+# The file is read just while the generator is used and is closed in the end.
+# So nothing but one block is in memory at any time.
+# 
+# ATTENTION: This works just for data where the variables are in the first 
+# line. "Physics data" can not be transposed block by block.
+# The blocks are stored as dtype, see read_data().
+def stream_data(infile, block_size = 10000, dtype = np.float64):
+	with open(infile, 'r') as f:
+		variables = get_variables(next(f))
+	# See read_data().
+	variables.pop(0)
+
+	# The file is opened again just when the generator is used. Thus it is 
+	# not left open if the generator never is.
+	def blocks():
+		with open(infile, 'r') as f:
+			next(f)
+			for labels, block in data_blocks(f, len(variables), block_size):
+				yield labels, block.astype(dtype, copy = False)
+
+	return variables, blocks()
+
+
+
+# Where the cache for infile is. The data is stored as .npy and everything
+# else (variables, observations and what the file looked like) is pickled.
+# Pickle gives back the labels exactly as they were read (numbers, or str in
+# whatever encoding the file has), which json would not.
+# "Physics data" is cached separately, already transposed. So the memory 
+# mapped array is always in the right order.
+# The same goes for other dtypes than np.float64 (see read_data()).
+def cache_files(infile, physics = False, dtype = np.float64):
+	folder = os.path.join(os.path.dirname(os.path.abspath(infile)), '.pca_cache')
+	name = os.path.basename(infile)
+	if physics:
+		name = name + '.physics'
+	if np.dtype(dtype) != np.float64:
+		name = name + '.' + np.dtype(dtype).name
+
+	return folder, os.path.join(folder, name + '.npy'), \
+										os.path.join(folder, name + '.pickle')
+
+
 
-	if physical_data == '1':
-		foo = deepcopy(variables)
-		bar = deepcopy(observations)
-		variables = bar
-		observations = foo
-		data = data.T
+# The hash of the content of infile, read in pieces of 1 MB.
+def file_hash(infile):
+	sha1 = hashlib.sha1()
+	with open(infile, 'rb') as f:
+		for piece in iter(lambda: f.read(2**20), b''):
+			sha1.update(piece)
 
-	# data will later be changed during the process, but I need
-	# the original data for some calculations and one never knows. Hence
-	# I copy it here.
-	rawdata = deepcopy(data)
+	return sha1.hexdigest()
 
-	return data, rawdata, variables, observations
 
 
+# Returns variables, observations and data from the cache, or None if there
+# is no cache for infile, infile changed since or the cache can't be read.
+# If size and modification time of infile are the same as when the cache was 
+# written, the cache is used right away. If not, the content is compared via
+# its hash (e.g. the file was just copied or touched).
+# The data is memory mapped ("copy on write"): It is read from the disk just
+# when needed and changing it doesn't change the cache.
+def get_cached(infile, physics = False, dtype = np.float64):
+	folder, data_file, info_file = cache_files(infile, physics, dtype)
+	if not (os.path.exists(data_file) and os.path.exists(info_file)):
+		return None
 
+	try:
+		with open(info_file, 'rb') as f:
+			info = pickle.load(f)
+	except (IOError, OSError, EOFError, pickle.UnpicklingError):
+		return None
 
+	stat = os.stat(infile)
+	if info['size'] != stat.st_size:
+		return None
 
+	if info['mtime'] != stat.st_mtime:
+		if info['hash'] != file_hash(infile):
+			return None
 
+		# Next time the hash is not needed. If the cache can't be written, 
+		# it is needed again, but that is all.
+		info['mtime'] = stat.st_mtime
+		try:
+			write_info(info_file, info)
+		except (IOError, OSError):
+			pass
+
+	data = np.load(data_file, mmap_mode = 'c')
+
+	return info['variables'], info['observations'], data
+
+
+
+# Stores what read_data() got from infile in the cache.
+# The cache is just there to be faster. If it can't be written (e.g. infile 
+# is in a folder that is not writable), nothing is cached and nothing else 
+# happens.
+def write_cache(infile, variables, observations, data, physics = False, \
+														dtype = np.float64):
+	folder, data_file, info_file = cache_files(infile, physics, dtype)
+
+	try:
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+
+		stat = os.stat(infile)
+		info = {'size': stat.st_size, 'mtime': stat.st_mtime, \
+				'hash': file_hash(infile), 'variables': variables, \
+				'observations': observations}
+
+		# First write into a temporary file and rename it then. Thus another 
+		# program never reads a half written cache.
+		np.save(data_file + '.tmp.npy', data)
+		os.rename(data_file + '.tmp.npy', data_file)
+		write_info(info_file, info)
+	except (IOError, OSError, UnicodeError, pickle.PicklingError) as error:
+		print "\nThe data could not be cached (%s).\n" % error
+		# The data without the info is of no use.
+		for leftover in [data_file + '.tmp.npy', info_file + '.tmp', data_file]:
+			try:
+				os.remove(leftover)
+			except OSError:
+				pass
 
 
 
+def write_info(info_file, info):
+	with open(info_file + '.tmp', 'wb') as f:
+		pickle.dump(info, f, pickle.HIGHEST_PROTOCOL)
+	os.rename(info_file + '.tmp', info_file)
@@ -0,0 +1,268 @@
+#    "PCA" (v0.7)
+#    Copyright 2016 Soren Heinze
+#    soerenheinze@gmx.de
+#    5B1C 1897 560A EF50 F1EB 2579 2297 FAE4 D9B5 2A35
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# PCA.py asks for everything and plots everything. This is the same without
+# any questions and without any windows: read the data, preprocess it,
+# run NIPALS and save the results. Either from python:
+#
+# import run_pca as rp
+# result = rp.run_pca('/home/<user>/data/foo.txt', 3)
+# rp.save_results('foo_pca.npz', result)
+#
+# or from the command line (see main() or "python run_pca.py --help"):
+#
+# python run_pca.py /home/<user>/data/foo.txt -c 3 -o foo_pca.npz
+#
+# Many files are fitted at the same time, each in its own process (see 
+# run_many()):
+#
+# python run_pca.py "/home/<user>/data/*.txt" -c 3 --workers 8
+
+import numpy as np
+import argparse
+import os
+import glob
+import time
+import traceback
+from multiprocessing import Pool
+import read_data as rd
+import data_preprocessing as dp
+import nipals_algorithm as na
+
+# What the answers to the questions of PCA.py are called on the command line.
+PREPROCESSING = {'all': '', 'center': '1', 'none': '0'}
+
+# Does what PCA.py does, just without asking and plotting.
+# physics, these_processes and enhance_these are the answers to the questions
+# PCA.py would ask (see read_data.read_data() and
+# data_preprocessing.get_transform()). E.g. these_processes = '1' is just
+# mean centering and enhance_these = '2,5' enhances variables 2 and 5.
+# Everything in nipals_options is handed over to na.nipals_pca() (e.g.
+# engine = 'block').
+#
+# Returned is a dictionary with the results, the labels and the
+# preprocessing (see save_results()).
+def run_pca(infile, number_of_components, physics = False, \
+				these_processes = '', enhance_these = '', cache = True, \
+				dtype = np.float64, **nipals_options):
+	data, variables, observations = rd.read_data(infile, cache = cache, \
+											dtype = dtype, physics = physics)
+
+	transform = dp.get_transform(these_processes, enhance_these, data)
+	dp.apply_transform(transform, data)
+
+	nipals_options.setdefault('show_plots', False)
+	output = na.nipals_pca(data, None, number_of_components, \
+					reference_variances = dp.reference_variances(transform), \
+					**nipals_options)
+	Z_merged, P_merged, r_merged, R_2, R_k_2, SPE, T_2 = output[:7]
+
+	result = {'scores': Z_merged, 'loadings': P_merged, \
+			'correlation_loadings': r_merged, 'R_2': R_2, 'R_k_2': R_k_2, \
+			'SPE': SPE, 'T_2': T_2, 'variables': variables, \
+			'observations': observations, 'mean': transform['mean'], \
+			'scale': transform['scale'], 'boost': transform['boost']}
+
+	if len(output) > 7:
+		result['iterations'] = output[7]['iterations']
+		result['eigenvalues'] = output[7]['eigenvalues']
+
+	return result
+
+
+
+# Saves what run_pca() returned as a .npz file (see np.load()).
+# The labels can be numbers or text, hence they are stored as text.
+def save_results(outfile, result):
+	to_save = {}
+	for key, value in result.items():
+		if key in ['variables', 'observations']:
+			to_save[key] = np.array([str(label) for label in value])
+		else:
+			to_save[key] = np.asarray(value)
+
+	np.savez(outfile, **to_save)
+
+
+
+# Where save_results() puts the results for infile if nothing else is said.
+def default_outfile(infile, outfolder = None):
+	outfile = os.path.splitext(infile)[0] + '_pca.npz'
+	if outfolder is not None:
+		outfile = os.path.join(outfolder, os.path.basename(outfile))
+
+	return outfile
+
+
+
+# Fits many files, each with run_pca() and in its own process. So workers 
+# files (default: as many as there are cores) are fitted at the same time.
+# infiles is a list of files or of patterns like "/home/<user>/data/*.txt".
+# All other arguments are the same for all files and handed over to 
+# run_pca().
+# 
+# With save = True the results of each file are saved (see default_outfile())
+# by the process that fitted it and not sent back. Otherwise they are 
+# returned.
+# Returned is for each file (sorted by name) a dictionary with 'infile', 
+# 'seconds' (how long it took), 'result' (or 'outfile' with save = True) 
+# and 'error'. If something goes wrong with one file, 'error' is what 
+# python said and the other files are fitted anyway.
+# 
+# ATTENTION: numpy may use more than one core for a single matrix 
+# multiplication, too. With many workers it is usually faster to switch this
+# off (e.g. OMP_NUM_THREADS=1 before python is started).
+def run_many(infiles, number_of_components, workers = None, save = False, \
+									outfolder = None, **run_pca_options):
+	all_infiles = []
+	for pattern in infiles:
+		found = glob.glob(pattern)
+		if found:
+			all_infiles.extend(found)
+		else:
+			# Let run_pca() say what is wrong with it.
+			all_infiles.append(pattern)
+	all_infiles = sorted(set(all_infiles))
+
+	if save and outfolder is not None and not os.path.exists(outfolder):
+		os.makedirs(outfolder)
+
+	jobs = [(infile, number_of_components, save, outfolder, run_pca_options) \
+												for infile in all_infiles]
+
+	pool = Pool(workers)
+	try:
+		done = pool.map(fit_one, jobs, chunksize = 1)
+	finally:
+		pool.close()
+		pool.join()
+
+	return done
+
+
+
+# What each process of run_many() does with one file. 
+# ATTENTION: This needs to be a function of the module (and not e.g. a 
+# lambda), otherwise multiprocessing can't send it to the processes.
+def fit_one(job):
+	infile, number_of_components, save, outfolder, run_pca_options = job
+	done = {'infile': infile, 'error': None}
+
+	start = time.time()
+	try:
+		result = run_pca(infile, number_of_components, **run_pca_options)
+		if save:
+			done['outfile'] = default_outfile(infile, outfolder)
+			save_results(done['outfile'], result)
+		else:
+			done['result'] = result
+	except Exception:
+		done['error'] = traceback.format_exc()
+	done['seconds'] = time.time() - start
+
+	return done
+
+
+
+# The command line version of run_pca() and run_many(). arguments are the 
+# command line arguments (without the name of the program), sys.argv[1:] if 
+# not given.
+def main(arguments = None):
+	parser = argparse.ArgumentParser(description = "PCA via NIPALS, " + \
+								"without any questions and without plotting.")
+	parser.add_argument('infiles', nargs = '+', help = "the data file(s) " + \
+					"(see README.md), patterns like '*.txt' are allowed")
+	parser.add_argument('-c', '--components', type = int, default = 3, \
+					help = "number of components (> 1, default: 3)")
+	parser.add_argument('-o', '--outfile', default = None, \
+					help = "where the results are saved (.npz, default: " + \
+					"the name of infile + '_pca.npz'). For more than one " + \
+					"file the folder where the results are saved.")
+	parser.add_argument('-w', '--workers', type = int, default = None, \
+					help = "how many files are fitted at the same time " + \
+										"(default: as many as there are cores)")
+	parser.add_argument('--physics', action = 'store_true', \
+					help = "the data is 'physics data' (see README.md)")
+	parser.add_argument('--preprocess', choices = sorted(PREPROCESSING), \
+					default = 'all', help = "'all' = normalization AND mean " + \
+					"centering (default), 'center' = just mean centering, " + \
+					"'none' = nothing")
+	parser.add_argument('--enhance', default = '', \
+					help = "variables to enhance, e.g. '2,5'")
+	parser.add_argument('--engine', default = 'vectorized', \
+					choices = ['vectorized', 'loops', 'block', 'impute', \
+										'randomized'], help = "see nipals_pca()")
+	parser.add_argument('--float32', action = 'store_true', \
+					help = "store the data with single precision")
+	parser.add_argument('--no-cache', action = 'store_true', \
+					help = "don't use the .pca_cache folder")
+	options = parser.parse_args(arguments)
+
+	# See nipals_algorithm.create_matrices() and nipals_pca().
+	if options.components < 2:
+		parser.error("at least 2 components are needed")
+	if options.float32 and options.engine != 'vectorized':
+		parser.error("--float32 works just with --engine vectorized")
+
+	if options.float32:
+		dtype = np.float32
+	else:
+		dtype = np.float64
+
+	run_pca_options = {'physics': options.physics, \
+				'these_processes': PREPROCESSING[options.preprocess], \
+				'enhance_these': options.enhance, \
+				'cache': not options.no_cache, 'dtype': dtype, \
+				'engine': options.engine, 'full_output': True}
+
+	if len(options.infiles) == 1 and not glob.has_magic(options.infiles[0]):
+		infile = options.infiles[0]
+		outfile = options.outfile
+		if outfile is None:
+			outfile = default_outfile(infile)
+
+		result = run_pca(infile, options.components, **run_pca_options)
+		save_results(outfile, result)
+
+		print "\nResults saved in %s\n" % outfile
+		return
+
+	start = time.time()
+	all_done = run_many(options.infiles, options.components, \
+						workers = options.workers, save = True, \
+						outfolder = options.outfile, **run_pca_options)
+
+	print "\n=================="
+	for done in all_done:
+		if done['error'] is None:
+			print "%s: %.2f s -> %s" % (done['infile'], done['seconds'], \
+															done['outfile'])
+		else:
+			print "%s: %.2f s FAILED\n%s" % (done['infile'], done['seconds'], \
+															done['error'])
+
+	so_many_failed = len([done for done in all_done if done['error']])
+	print "\n%s files in %.2f s, %s failed\n" % (len(all_done), \
+										time.time() - start, so_many_failed)
+
+
+
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,236 @@
+#    "PCA" (v0.7)
+#    Copyright 2016 Soren Heinze
+#    soerenheinze@gmx.de
+#    5B1C 1897 560A EF50 F1EB 2579 2297 FAE4 D9B5 2A35
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# A small server that keeps a model (see pca_model.py) in memory and tells
+# for new observations how unusual they are (SPE and Hotelling's T^2), e.g.
+# to watch a running process. It listens on localhost only.
+#
+# python scoring_service.py foo_model.npz --port 8642
+#
+# Each request is one line of JSON, e.g.
+# {"id": 17, "rows": [[1.2, 3.4, null, 5.6], [1.1, 3.3, 4.4, 5.5]]}
+# (null = missing value) and the answer is one line of JSON, too:
+# {"id": 17, "SPE": [...], "T_2": [...], "SPE_alarm": [...],
+#  "T_2_alarm": [...]}
+# SPE and T_2 are for all components of the model. The alarms are there if
+# the model has control limits (see pca_model.add_control_limits()). With
+# "scores": true in the request, the scores are sent back, too (one list
+# per row). If something is wrong with a request, the answer is
+# {"id": ..., "error": "..."}. One connection can send as many requests as
+# it likes, one after another, without waiting for the answers. The answers
+# come back in the same order as the requests.
+#
+# ATTENTION: This is python 2.7, which doesn't have asyncio. asyncore does
+# the same here: One process handles all connections, and never waits for
+# just one of them.
+# All requests that arrived while the server was looking at its connections
+# once are scored together with one call of pca_model.project() (see
+# score_pending()). Thus, the more requests arrive, the larger these
+# batches become, and numpy does the work instead of python.
+
+import numpy as np
+import asyncore
+import asynchat
+import socket
+import json
+import argparse
+import pca_model as pm
+
+# Runs the server until it is stopped (Ctrl-C).
+# timeout is how long (in seconds) the server waits for new requests if
+# there are none.
+def serve(model, host = '127.0.0.1', port = 8642, timeout = 0.05):
+	server = ScoringServer(model, host, port)
+	print "\nScoring on %s:%s\n" % server.getsockname()
+
+	try:
+		while True:
+			asyncore.loop(timeout = timeout, count = 1, map = server.connections)
+			score_pending(server)
+	finally:
+		asyncore.close_all(map = server.connections)
+
+
+
+# Accepts the connections. Everything that is needed while running is in
+# here: the model, all connections and the requests that still need an
+# answer.
+# ATTENTION: asyncore works just with classes.
+class ScoringServer(asyncore.dispatcher):
+	def __init__(self, model, host, port):
+		self.connections = {}
+		asyncore.dispatcher.__init__(self, map = self.connections)
+		self.model = model
+		self.pending = []
+
+		self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.set_reuse_addr()
+		self.bind((host, port))
+		self.listen(128)
+
+	def handle_accept(self):
+		pair = self.accept()
+		if pair is not None:
+			ScoringConnection(pair[0], self)
+
+
+
+# One connection. It just collects the lines (requests). These are answered
+# by score_pending().
+class ScoringConnection(asynchat.async_chat):
+	def __init__(self, connection, server):
+		asynchat.async_chat.__init__(self, connection, map = server.connections)
+		self.set_terminator('\n')
+		self.server = server
+		self.received = []
+
+	def collect_incoming_data(self, data):
+		self.received.append(data)
+
+	def found_terminator(self):
+		line = ''.join(self.received)
+		self.received = []
+		if line.strip() != '':
+			self.server.pending.append((self, line))
+
+
+
+# Answers all requests that arrived so far, with one call of
+# pca_model.project() for all their rows together.
+# The answers are sent in the order the requests arrived, also if some of 
+# them were wrong. Thus a client that sends many requests at once gets the 
+# answers in the same order.
+def score_pending(server):
+	if len(server.pending) == 0:
+		return
+
+	pending = server.pending
+	server.pending = []
+
+	model = server.model
+	number_of_columns = model['loadings'].shape[1]
+
+	# One reply for each request, filled in below.
+	replies = [None] * len(pending)
+	requests = []
+	all_rows = []
+	for i, (connection, line) in enumerate(pending):
+		try:
+			request = json.loads(line)
+			rows = np.array(request['rows'], dtype = np.float64, ndmin = 2)
+			if rows.ndim != 2 or rows.shape[1] != number_of_columns:
+				text = "Each row needs %s values." % number_of_columns
+				raise ValueError(text)
+		except Exception as error:
+			replies[i] = {'id': get_id(line), 'error': str(error)}
+			continue
+
+		requests.append((i, request))
+		all_rows.append(rows)
+
+	if len(requests) > 0:
+		fill_in_scores(model, requests, all_rows, replies)
+
+	for (connection, line), reply in zip(pending, replies):
+		answer(connection, reply)
+
+
+
+# Just to keep score_pending() more tidy. Scores the rows of all valid 
+# requests at once and puts the reply of each into replies.
+def fill_in_scores(model, requests, all_rows, replies):
+	try:
+		Z, SPE, T_2 = pm.project(model, np.vstack(all_rows))
+	except Exception as error:
+		for i, request in requests:
+			replies[i] = {'id': request.get('id'), 'error': str(error)}
+		return
+
+	start = 0
+	for (i, request), rows in zip(requests, all_rows):
+		these = slice(start, start + len(rows))
+		start += len(rows)
+
+		reply = {'id': request.get('id'), 'SPE': SPE[-1, these].tolist(), \
+											'T_2': T_2[-1, these].tolist()}
+		if 'SPE_limit' in model:
+			reply['SPE_alarm'] = (SPE[-1, these] > \
+									model['SPE_limit'][-1]).tolist()
+			reply['T_2_alarm'] = (T_2[-1, these] > \
+									model['T_2_limit'][-1]).tolist()
+		if request.get('scores'):
+			reply['scores'] = Z[:, these].T.tolist()
+
+		replies[i] = reply
+
+
+
+# Just to keep score_pending() more tidy.
+def answer(connection, reply):
+	connection.push(json.dumps(reply) + '\n')
+
+
+
+# The id of a request that couldn't be read, if it is there at all.
+def get_id(line):
+	try:
+		return json.loads(line).get('id')
+	except Exception:
+		return None
+
+
+
+# A very simple client, e.g. to try the server: sends rows (a list of
+# lists or an array) and returns the answer (see above).
+def score(rows, host = '127.0.0.1', port = 8642, scores = False):
+	request = {'id': 0, 'rows': np.asarray(rows, dtype = np.float64).tolist(), \
+															'scores': scores}
+	# json writes missing values as NaN, which is not really JSON.
+	line = json.dumps(request).replace('NaN', 'null')
+
+	connection = socket.create_connection((host, port))
+	try:
+		connection.sendall(line + '\n')
+		received = ''
+		while not received.endswith('\n'):
+			piece = connection.recv(65536)
+			if piece == '':
+				break
+			received += piece
+	finally:
+		connection.close()
+
+	return json.loads(received)
+
+
+
+def main(arguments = None):
+	parser = argparse.ArgumentParser(description = "Scores new " + \
+						"observations with a model from pca_model.save_model().")
+	parser.add_argument('model', help = "the model (.npz)")
+	parser.add_argument('--port', type = int, default = 8642)
+	options = parser.parse_args(arguments)
+
+	serve(pm.load_model(options.model), port = options.port)
+
+
+
+
+
+if __name__ == '__main__':
+	main()